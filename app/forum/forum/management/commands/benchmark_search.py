@@ -0,0 +1,88 @@
+import random
+import statistics
+import string
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from forum.models import Category, Thread
+from forum.util import get_query, get_similarity
+from user.models import ForumUser
+
+WORDS = ("forum politique musique voiture vacances cuisine jardin cinéma "
+         "photo football informatique linux serveur réseau livre histoire "
+         "science espace météo recette concert festival").split()
+# Index scans are disabled to get the plan of icontains without pg_trgm
+PLANS = {'icontains (sequential scan)': 'off', 'pg_trgm index': 'on'}
+
+
+class Command(BaseCommand):
+    help = ("Compare substring searches with and without the pg_trgm indexes "
+            "on a synthetic dataset, rolled back afterwards")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--queries', type=int, default=20,
+                            help="Searches timed per plan")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("pg_trgm requires PostgreSQL")
+        with transaction.atomic():
+            self.populate(options['threads'], options['users'])
+            self.benchmark(options['queries'])
+            transaction.set_rollback(True)
+
+    def populate(self, thread_count, user_count):
+        start = time.perf_counter()
+        users = ForumUser.objects.bulk_create(
+            ForumUser(username=self.word(i), email='{}@bench'.format(i))
+            for i in range(user_count))
+        category = Category.objects.create(slug='benchmark', title='Bench')
+        Thread.objects.bulk_create(
+            (Thread(title=' '.join(random.sample(WORDS, 3) + [self.word(i)]),
+                    slug='benchmark-{}'.format(i),
+                    cessionToken='benchmark-{}'.format(i),
+                    author=random.choice(users), category=category)
+             for i in range(thread_count)), batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE forum_thread, user_forumuser')
+        self.stdout.write("{} threads and {} users created in {:.1f} s"
+                          .format(thread_count, user_count,
+                                  time.perf_counter() - start))
+
+    @staticmethod
+    def word(seed):
+        return ''.join(random.choices(string.ascii_lowercase, k=6)) + \
+            str(seed)
+
+    def benchmark(self, count):
+        titles = list(Thread.objects.filter(category__slug='benchmark')
+                      .values_list('title', flat=True)[:count])
+        usernames = list(ForumUser.objects.filter(email__endswith='@bench')
+                         .values_list('username', flat=True)[:count])
+        searches = {
+            'title fragment': [(title.split()[-1][1:5], 'title')
+                               for title in titles],
+            'user: fragment': [(name[1:5], 'author__username')
+                               for name in usernames],
+        }
+        for name, queries in searches.items():
+            for plan, enabled in PLANS.items():
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_bitmapscan = ' + enabled)
+                    cursor.execute('SET LOCAL enable_indexscan = ' + enabled)
+                timings = []
+                for text, field in queries:
+                    start = time.perf_counter()
+                    list(Thread.objects.filter(get_query(text, [field]))
+                         .annotate(similarity=get_similarity(text, field))
+                         .order_by('-similarity', '-pk')
+                         .values_list('pk', flat=True)[:30])
+                    timings.append(time.perf_counter() - start)
+                self.stdout.write("{}, {}: median {:.2f} ms, max {:.2f} ms"
+                                  .format(name, plan,
+                                          statistics.median(timings) * 1000,
+                                          max(timings) * 1000))
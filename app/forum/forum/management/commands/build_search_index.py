@@ -0,0 +1,41 @@
+import time
+
+from django.contrib.postgres.search import SearchVector
+from django.core.management.base import BaseCommand
+
+from forum.models import Post, Thread
+from forum.util import SEARCH_CONFIG
+
+
+class Command(BaseCommand):
+    help = "Fill the full-text search vectors of threads and posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows updated per statement")
+        parser.add_argument('--all', action='store_true',
+                            help="Rebuild every vector, not only missing "
+                                 "ones, e.g. after a configuration change")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        for model, field in ((Thread, 'title'), (Post, 'content_plain')):
+            rows = model.objects.order_by('pk')
+            if not options['all']:
+                rows = rows.filter(search_vector__isnull=True)
+            name = model._meta.verbose_name_plural
+            total, done, last_pk = rows.count(), 0, 0
+            while True:
+                # Seek by pk, each statement being its own transaction
+                pks = list(rows.filter(pk__gt=last_pk).values_list(
+                    'pk', flat=True)[:options['batch_size']])
+                if not pks:
+                    break
+                done += model.objects.filter(pk__in=pks).update(
+                    search_vector=SearchVector(field, config=SEARCH_CONFIG))
+                last_pk = pks[-1]
+                self.stdout.write("{}: {}/{} ({:.1f} s)".format(
+                    name, done, total, time.perf_counter() - start))
+        self.stdout.write(self.style.SUCCESS(
+            "Search index built in {:.1f} s".format(
+                time.perf_counter() - start)))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from forum.models import VIEWS_CHUNK_SIZE, flush_views
+
+
+class Command(BaseCommand):
+    help = "Write the thread views counted in cache to the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=VIEWS_CHUNK_SIZE,
+                            help="Threads updated per statement")
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Keep flushing every INTERVAL seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            count = flush_views(options['chunk_size'])
+            if count is None:
+                self.stdout.write("Another flush is running, skipped")
+            elif options['verbosity'] > 1 or not options['interval']:
+                self.stdout.write("Flushed views of {} threads in {:.2f} s"
+                                  .format(count,
+                                          time.perf_counter() - start))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from forum.models import Category, Post, Thread
+
+
+class Command(BaseCommand):
+    help = "Rebuild thread and category counters from the posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Threads updated per statement")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        posts = Post.objects.filter(thread=OuterRef('pk')).order_by()
+        latest = posts.order_by('-pk')
+        post_count = posts.values('thread').annotate(count=Count('pk'))\
+                          .values('count')
+        batch_size = options['batch_size']
+        last_pk = Thread.objects.aggregate(Max('pk'))['pk__max'] or 0
+        for bottom in range(0, last_pk + 1, batch_size):
+            with transaction.atomic():
+                Thread.objects.filter(pk__gte=bottom,
+                                      pk__lt=bottom + batch_size).update(
+                    post_count=Coalesce(Subquery(post_count), 0),
+                    last_post=Subquery(latest.values('pk')[:1]),
+                    last_author=Subquery(latest.values('author')[:1]),
+                    modified=Coalesce(Subquery(latest.values('created')[:1]),
+                                      F('modified')))
+            self.stdout.write("threads: {}/{} ({:.1f} s)".format(
+                min(bottom + batch_size - 1, last_pk), last_pk,
+                time.perf_counter() - start))
+
+        threads = Thread.objects.filter(category=OuterRef('pk')).order_by()
+        Category.objects.update(
+            thread_count=Coalesce(Subquery(
+                threads.filter(visible=True).values('category')
+                       .annotate(count=Count('pk')).values('count')), 0),
+            post_count=Coalesce(Subquery(
+                threads.values('category').annotate(count=Sum('post_count'))
+                       .values('count')), 0),
+            last_thread=Subquery(
+                threads.order_by('-modified').values('pk')[:1]))
+        self.stdout.write(self.style.SUCCESS(
+            "Counters rebuilt in {:.1f} s".format(
+                time.perf_counter() - start)))
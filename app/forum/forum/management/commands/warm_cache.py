@@ -0,0 +1,145 @@
+import datetime
+import time
+from multiprocessing import Pool
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Case, Q, Value, When
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from forum.models import Category, Post, Thread, get_contributors, \
+    set_cached_authors, set_generations
+from forum.views import POSTVIEW_PAGINATE_BY, THREADVIEW_PAGINATE_BY
+from user.models import BOOKMARK_KEY, Bookmark, ForumUser, \
+    get_author_cards
+from utils.management.commands.rerender import render_row
+from utils.renderer import RENDERER_VERSION
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def add_many(data):
+    """Cache the keys of data which are missing, leaving live ones as is.
+    cache.add is atomic, so a value written by live traffic meanwhile is
+    never overwritten."""
+    return sum(cache.add(key, value, None) for key, value in data.items())
+
+
+class Command(BaseCommand):
+    help = ("Fill the cache after a deploy or a memcached restart. Keys are "
+            "written one cache.add at a time, never overwriting the fresher "
+            "values of live traffic, so that it is safe to run on a live "
+            "site")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=500,
+                            help="Most recently active threads to warm")
+        parser.add_argument('--pages', type=int, default=2,
+                            help="Last pages of each thread to warm")
+        parser.add_argument('--days', type=int, default=31,
+                            help="Warm users seen in the last DAYS days")
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--processes', type=int, default=0,
+                            help="Processes rendering outdated posts "
+                                 "(default: render in this process)")
+
+    def handle(self, *args, **options):
+        self.start = time.perf_counter()
+        self.chunk_size = options['chunk_size']
+        threads = self.warm_threads(options['threads'])
+        self.warm_users(options['days'], [t.pk for t in threads])
+        self.warm_posts(threads, options['pages'], options['processes'])
+        self.stdout.write(self.style.SUCCESS(
+            "Cache warmed in {:.1f} s".format(self.elapsed())))
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def report(self, name, done, total):
+        self.stdout.write("{}: {}/{} ({:.1f} s)".format(
+            name, done, total, self.elapsed()))
+
+    def warm_users(self, days, threads):
+        """Cache the recent users, and their bookmarks on threads."""
+        since = timezone.now() - datetime.timedelta(days=days)
+        pks = list(ForumUser.objects.filter(
+            Q(last_login__gte=since) | Q(last_seen__gte=since))
+            .order_by('pk').values_list('pk', flat=True))
+        done = 0
+        for chunk in chunks(pks, self.chunk_size):
+            get_author_cards(chunk)
+            add_many({'user/{}'.format(user.pk): user
+                      for user in ForumUser.objects.filter(pk__in=chunk)})
+            add_many({BOOKMARK_KEY.format(user, thread): timestamp
+                      for user, thread, timestamp in Bookmark.objects.filter(
+                          user__in=chunk, thread__in=threads)
+                      .values_list('user', 'thread', 'timestamp')})
+            done += len(chunk)
+            self.report("users", done, len(pks))
+
+    def warm_threads(self, count):
+        """Render the cached cells of the recent threads and of the first
+        page of each category."""
+        threads = Thread.objects.filter(visible=True)\
+            .select_related('category')
+        recent = list(threads.order_by('-modified')[:count])
+        pks = {t.pk for t in recent}
+        for category in Category.objects.all():
+            recent += [t for t in threads.filter(category=category)
+                       [:THREADVIEW_PAGINATE_BY] if t.pk not in pks]
+            pks.update(t.pk for t in recent)
+        done = 0
+        for chunk in chunks(recent, self.chunk_size):
+            set_cached_authors(chunk)
+            set_generations(chunk)
+            get_contributors(t.pk for t in chunk)
+            for t in chunk:
+                render_to_string('forum/thread_row.html',
+                                 {'thread': t, 'category': t.category})
+            done += len(chunk)
+            self.report("threads", done, len(recent))
+        return recent
+
+    def warm_posts(self, threads, pages, processes):
+        """Cache the authors of the last pages of threads, and re-render
+        their posts if the renderer changed since."""
+        queries = [Q(thread=t.pk, position__gte=max(
+                     t.post_count - pages * POSTVIEW_PAGINATE_BY, 0))
+                   for t in threads]
+        if processes:
+            # Forked workers must not share the parent's database connections
+            connections.close_all()
+        pool = Pool(processes) if processes else None
+        done = rendered = 0
+        try:
+            for chunk in chunks(queries, max(
+                    self.chunk_size // (pages * POSTVIEW_PAGINATE_BY), 1)):
+                query = Q()
+                for q in chunk:
+                    query |= q
+                posts = Post.objects.filter(query)
+                get_author_cards(posts.values_list('author', flat=True))
+                rows = list(posts.exclude(renderer_version=RENDERER_VERSION)
+                            .values_list('pk', 'content_plain'))
+                if rows:
+                    html = dict(pool.imap(render_row, rows, chunksize=20)
+                                if pool else map(render_row, rows))
+                    # Posts edited meanwhile are already up to date
+                    content_html = Case(*[When(pk=pk, then=Value(value))
+                                          for pk, value in html.items()])
+                    rendered += Post.objects.filter(pk__in=html)\
+                        .exclude(renderer_version=RENDERER_VERSION)\
+                        .update(content_html=content_html,
+                                renderer_version=RENDERER_VERSION)
+                done += len(chunk)
+                self.report("posts of threads", done, len(queries))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        self.stdout.write("{} outdated posts re-rendered".format(rendered))
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0009_budgetrecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='renderer_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
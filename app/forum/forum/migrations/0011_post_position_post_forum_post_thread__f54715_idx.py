@@ -0,0 +1,32 @@
+# Generated by Django 4.2.21 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0010_post_content_html_post_renderer_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='position',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE forum_post SET position = ranked.position
+            FROM (SELECT id, row_number() OVER (
+                      PARTITION BY thread_id ORDER BY id) - 1 AS position
+                  FROM forum_post) AS ranked
+            WHERE forum_post.id = ranked.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['thread', 'position'], name='forum_post_thread__f54715_idx'),
+        ),
+    ]
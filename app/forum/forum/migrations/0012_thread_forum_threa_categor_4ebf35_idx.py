@@ -0,0 +1,17 @@
+# Generated by Django 4.2.21 on 2026-10-18 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0011_post_position_post_forum_post_thread__f54715_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['category', '-isSticky', '-modified', 'id'], name='forum_threa_categor_4ebf35_idx'),
+        ),
+    ]
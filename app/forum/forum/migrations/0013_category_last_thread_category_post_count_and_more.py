@@ -0,0 +1,72 @@
+# Generated by Django 4.2.21 on 2026-10-18 13:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('forum', '0012_thread_forum_threa_categor_4ebf35_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='last_thread',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='forum.thread'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='thread_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='last_author',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='last_post',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='forum.post'),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE forum_thread
+            SET post_count = counts.post_count,
+                last_post_id = counts.last_post_id,
+                last_author_id = counts.last_author_id
+            FROM (SELECT DISTINCT ON (thread_id) thread_id,
+                         count(*) OVER (PARTITION BY thread_id) AS post_count,
+                         id AS last_post_id, author_id AS last_author_id
+                  FROM forum_post
+                  ORDER BY thread_id, id DESC) AS counts
+            WHERE forum_thread.id = counts.thread_id;
+            UPDATE forum_category
+            SET thread_count = (
+                    SELECT count(*) FROM forum_thread
+                    WHERE category_id = forum_category.id AND visible),
+                post_count = (
+                    SELECT coalesce(sum(post_count), 0) FROM forum_thread
+                    WHERE category_id = forum_category.id),
+                last_thread_id = (
+                    SELECT id FROM forum_thread
+                    WHERE category_id = forum_category.id
+                    ORDER BY modified DESC LIMIT 1);
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,56 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import UnaccentExtension
+from django.db import migrations
+
+SEARCH_TRIGGER = """
+CREATE TRIGGER {table}_search_vector
+BEFORE INSERT OR UPDATE OF {column} ON {table}
+FOR EACH ROW EXECUTE PROCEDURE
+tsvector_update_trigger(search_vector, 'public.french_unaccent', {column});
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0013_category_last_thread_category_post_count_and_more'),
+    ]
+
+    operations = [
+        UnaccentExtension(),
+        migrations.RunSQL(
+            """
+            CREATE TEXT SEARCH CONFIGURATION public.french_unaccent
+                (COPY = pg_catalog.french);
+            ALTER TEXT SEARCH CONFIGURATION public.french_unaccent
+                ALTER MAPPING FOR hword, hword_part, word
+                WITH unaccent, french_stem;
+            """,
+            "DROP TEXT SEARCH CONFIGURATION public.french_unaccent;"),
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='forum_post_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='forum_thread_search_idx'),
+        ),
+        # Existing rows are indexed by the build_search_index command
+        migrations.RunSQL(
+            SEARCH_TRIGGER.format(table='forum_post', column='content_plain'),
+            "DROP TRIGGER forum_post_search_vector ON forum_post;"),
+        migrations.RunSQL(
+            SEARCH_TRIGGER.format(table='forum_thread', column='title'),
+            "DROP TRIGGER forum_thread_search_vector ON forum_thread;"),
+    ]
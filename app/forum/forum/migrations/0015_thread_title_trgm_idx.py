@@ -0,0 +1,21 @@
+# Generated by Django 4.2.21 on 2026-10-18 13:41
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0014_search_vector'),
+        # Creates the pg_trgm extension, dropped last when reversing
+        ('user', '0009_forumuser_username_trgm_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='thread',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('title'), name='gin_trgm_ops'), name='forum_thread_title_trgm_idx'),
+        ),
+    ]
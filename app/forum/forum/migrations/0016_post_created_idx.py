@@ -0,0 +1,17 @@
+# Generated by Django 4.2.21 on 2026-10-18 13:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0015_thread_title_trgm_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created'], name='forum_post_created_9fb640_idx'),
+        ),
+    ]
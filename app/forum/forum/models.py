@@ -1,7 +1,10 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Upper
 from django.core.cache import cache
-from django.core.cache.utils import make_template_fragment_key
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 
@@ -11,44 +14,59 @@ from django.utils import timezone
 
 from uuslug import uuslug
 
-from utils.renderer import UserReferences, render
-from .util import keygen
-from user.models import ForumUser, Bookmark
+from utils.models import RenderedModel
+from utils.renderer import render
+from .util import bump_generation, get_generations, keygen
+from user.models import ForumUser, Bookmark, get_author_card, \
+    get_author_cards
 
 SLUG_LENGTH = 50
+MENTIONS_CHUNK_SIZE = 1000
+VIEWS_CHUNK_SIZE = 500
+VIEWS_KEY = 'views/{}'  # Views not yet written to Thread.viewCount
+VIEWS_LOG_KEY = 'views/log'  # Number of threads logged as having views
+VIEWS_FLUSHED_KEY = 'views/flushed'  # Log position of the last flush
+VIEWS_LOCK_KEY = 'views/flush:lock'  # Held by the running flush
+VIEWS_LOCK_TIMEOUT = 600  # Longer than any flush, in case it died
+CONTRIBUTORS_KEY = 'thread/{}/contributors'  # Ids of the thread's authors
 
 
 # Abstract models
 class CachedAuthorModel(models.Model):
-    """Gets author from cache else from db and create cache"""
+    """Gets author card from cache else from db and create cache"""
 
     @property
     def cached_author(self):
-        author = cache.get('user/{}'.format(self.author_id))
-        if not author:
-            author = ForumUser.objects.get(pk=self.author_id)
-            cache.set('user/{}'.format(self.author_id), author, None)
-        return author
+        if not hasattr(self, '_cached_author'):
+            self._cached_author = get_author_card(self.author_id)
+        return self._cached_author
 
     class Meta:
         abstract = True
 
 
+class SearchVectorManager(models.Manager):
+    """Leaves search_vector out of loaded rows, it is only queried"""
+
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
+
+
 # Basic Forum models
 class Category(models.Model):
     """Contains threads."""
     slug = models.SlugField(blank=False, unique=True, db_index=True)
     title = models.CharField(max_length=50, blank=False)
     subtitle = models.CharField(max_length=200)
-
-    @property
-    def post_count(self):
-        key = f"category/{self.pk}/post_count"
-        count = cache.get(key)
-        if not count:
-            count = Post.objects.filter(thread__category__pk=self.pk).count()
-            cache.set(key, count, None)
-        return count
+    # Counters, maintained by Thread.save and Post.save
+    thread_count = models.PositiveIntegerField(default=0, editable=False)
+    post_count = models.PositiveIntegerField(default=0, editable=False)
+    last_thread = models.ForeignKey(
+        'Thread',
+        null=True,
+        editable=False,
+        related_name='+',
+        on_delete=models.SET_NULL)
 
     class Meta:
         ordering = ["pk"]
@@ -83,15 +101,58 @@ class Thread(CachedAuthorModel):
     personal = models.BooleanField(default=False)
     visible = models.BooleanField(default=True)
     cessionToken = models.CharField(max_length=50, unique=True)
+    # Counters, maintained by Post.save. modified is the last post's time
+    post_count = models.PositiveIntegerField(default=0, editable=False)
+    last_post = models.ForeignKey(
+        'Post',
+        null=True,
+        editable=False,
+        related_name='+',
+        on_delete=models.SET_NULL)
+    last_author = models.ForeignKey(
+        ForumUser,
+        null=True,
+        editable=False,
+        related_name='+',
+        on_delete=models.SET_NULL)
+    # Full-text index of the title, maintained by a trigger
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = SearchVectorManager()
+
+    COUNTER_FIELDS = ('post_count', 'last_post', 'last_author', 'modified')
 
     @property
-    def post_count(self):
-        key = f"thread/{self.pk}/post_count"
-        count = cache.get(key)
-        if not count:
-            count = self.posts.count() - 1
-            cache.set(key, count, None)
-        return count
+    def reply_count(self):
+        return max(self.post_count - 1, 0)
+
+    @property
+    def cached_last_author(self):
+        if not hasattr(self, '_cached_last_author'):
+            self._cached_last_author = get_author_card(
+                self.last_author_id) if self.last_author_id else None
+        return self._cached_last_author
+
+    @property
+    def pending_views(self):
+        if not hasattr(self, '_pending_views'):
+            self._pending_views = cache.get(VIEWS_KEY.format(self.pk), 0)
+        return self._pending_views
+
+    @property
+    def view_count(self):
+        return self.viewCount + self.pending_views
+
+    def add_view(self):
+        """Count a view, written to the database by flush_views."""
+        key = VIEWS_KEY.format(self.pk)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            count = 1 if cache.add(key, 1, None) else cache.incr(key)
+        if count == 1:
+            log_views(self.pk)
+        self._pending_views = count
 
     def save(self, *args, **kwargs):
 
@@ -110,14 +171,12 @@ class Thread(CachedAuthorModel):
                     return token
 
         new_slug = make_slug(self, self.title)
+        orig = None
         if self.pk is not None:  # This is an existing thread
             orig = Thread.objects.get(pk=self.pk)
-            # Delete template cache when needed and create new slug
-            if orig.slug != new_slug or orig.icon != self.icon:
+            # Create new slug when needed
+            if orig.slug != new_slug:
                 self.slug = new_slug
-                key = make_template_fragment_key(
-                    'thread', [self.pk])
-                cache.delete(key)  # Fails silently
             # Change cessionToken if the author has changed or db migration
             if orig.author != self.author or self.cessionToken == 'tmp':
                 self.cessionToken = create_token(self)
@@ -128,20 +187,41 @@ class Thread(CachedAuthorModel):
             self.cessionToken = create_token(self)
         if not self.slug:  # Prevent slugs to be empty
             self.slug = make_slug(self, 'sans titre')
-        super().save(*args, **kwargs)
-
-    @property
-    def latest_post(self):
-        latest_post = cache.get('thread/{}/latest_post'.format(self.pk))
-        if not latest_post:
-            latest_post = self.posts.latest()
-            cache.set(
-                'thread/{}/latest_post'.format(self.pk), latest_post, None)
-        return latest_post
+        if orig is not None and 'update_fields' not in kwargs:
+            # Counters are only written by Post.save, don't overwrite them
+            # with the possibly outdated values of this instance
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.COUNTER_FIELDS
+                and f.name != 'search_vector']
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Update category counters
+            if orig is None:
+                if self.visible:
+                    Category.objects.filter(pk=self.category_id)\
+                        .update(thread_count=F('thread_count') + 1)
+            elif orig.visible != self.visible or \
+                    orig.category_id != self.category_id:
+                Category.objects.filter(pk=orig.category_id).update(
+                    thread_count=F('thread_count') - int(orig.visible),
+                    post_count=F('post_count') - orig.post_count)
+                Category.objects.filter(pk=self.category_id).update(
+                    thread_count=F('thread_count') + int(self.visible),
+                    post_count=F('post_count') + orig.post_count)
 
     class Meta:
         ordering = ["-isSticky", "-modified", "pk"]
-        indexes = [models.Index(fields=["category", "slug"])]
+        indexes = [
+            models.Index(fields=["category", "slug"]),
+            # Thread lists
+            models.Index(fields=["category", "-isSticky", "-modified", "id"]),
+            GinIndex(fields=["search_vector"],
+                     name="forum_thread_search_idx"),
+            # Substring searches, i.e. title__icontains
+            GinIndex(OpClass(Upper("title"), name="gin_trgm_ops"),
+                     name="forum_thread_title_trgm_idx"),
+        ]
         # Permit category.threads.latest in template
         get_latest_by = "modified"
 
@@ -149,7 +229,7 @@ class Thread(CachedAuthorModel):
         return "{}/{}".format(self.category.slug, self.slug)
 
 
-class Post(CachedAuthorModel):
+class Post(CachedAuthorModel, RenderedModel):
     """A post."""
     created = models.DateTimeField(default=timezone.now,
                                    editable=False)
@@ -164,24 +244,47 @@ class Post(CachedAuthorModel):
         Thread,
         related_name='posts',
         on_delete=models.CASCADE)
+    # Number of posts before this one in the thread
+    position = models.PositiveIntegerField(default=0, editable=False)
+    # Full-text index of content_plain, maintained by a trigger
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = SearchVectorManager()
 
     def save(self, *args, **kwargs):
-        self.thread.contributors.add(self.author)
+        add_contributor(self.thread, self.author_id)
         if self.pk is None:  # Which means this is a new post, not an edit
+            thread = Thread.objects.filter(pk=self.thread_id)
+            with transaction.atomic():
+                # Lock the thread until the post is inserted so that
+                # concurrent posts get distinct positions
+                thread.select_for_update().exists()
+                latest = self.thread.posts.aggregate(
+                    position=models.Max('position'))['position']
+                self.position = 0 if latest is None else latest + 1
+                super().save(*args, **kwargs)
+                # Update thread and category counters
+                thread.update(post_count=F('post_count') + 1,
+                              last_post=self,
+                              last_author=self.author_id,
+                              modified=self.created)
+                Category.objects.filter(pk=self.thread.category_id)\
+                    .update(post_count=F('post_count') + 1,
+                            last_thread=self.thread_id)
+                transaction.on_commit(
+                    lambda: bump_generation('thread', self.thread_id))
             self.thread.modified = self.created
-            self.thread.save()
-        super().save(*args, **kwargs)
-
-    @property
-    def html(self):
-        html = cache.get('post/{}/html'.format(self.pk))
-        if not html:
-            html = render(self.content_plain, 'bbcode')
-            cache.set('post/{}/html'.format(self.pk), html, None)
-        return html
+        else:
+            super().save(*args, **kwargs)
 
     class Meta:
         ordering = ["pk"]
+        indexes = [
+            models.Index(fields=["thread", "position"]),
+            # Search filters after: and before:
+            models.Index(fields=["created"]),
+            GinIndex(fields=["search_vector"], name="forum_post_search_idx"),
+        ]
         # Permit thread.posts.latest in template
         get_latest_by = "created"
 
@@ -261,49 +364,178 @@ class BudgetRecord(models.Model):
         ordering = ["pk"]
 
 
+# Helpers
+def bulk_add_mentions(post, user_ids, chunk_size=MENTIONS_CHUNK_SIZE):
+    """Record mentions of users in post and flag them, chunk by chunk."""
+    for i in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[i:i + chunk_size]
+        UserMentions.objects.bulk_create(
+            [UserMentions(user_id=pk, post=post) for pk in chunk],
+            ignore_conflicts=True)
+        ForumUser.objects.filter(pk__in=chunk).update(newMention=True)
+        # update() bypasses update_user_cache
+        cache.set_many({'user/{}'.format(user.pk): user
+                        for user in ForumUser.objects.filter(pk__in=chunk)},
+                       None)
+
+
+def log_views(thread_id):
+    """Record that thread_id has views waiting to be flushed."""
+    try:
+        position = cache.incr(VIEWS_LOG_KEY)
+    except ValueError:
+        position = 1 if cache.add(VIEWS_LOG_KEY, 1, None) else \
+            cache.incr(VIEWS_LOG_KEY)
+    cache.set('{}/{}'.format(VIEWS_LOG_KEY, position), thread_id, None)
+
+
+def set_pending_views(threads):
+    """Fetch the pending views of threads at once."""
+    keys = {VIEWS_KEY.format(t.pk): t for t in threads}
+    pending = cache.get_many(keys)
+    for key, t in keys.items():
+        t._pending_views = pending.get(key, 0)
+
+
+def set_cached_authors(objects):
+    """Fetch the authors of objects, and last authors of threads, at once."""
+    objects = [obj for obj in objects if obj is not None]
+    users = get_author_cards(
+        [obj.author_id for obj in objects] +
+        [obj.last_author_id for obj in objects
+         if getattr(obj, 'last_author_id', None)])
+    for obj in objects:
+        obj._cached_author = users.get(obj.author_id)
+        if isinstance(obj, Thread):
+            obj._cached_last_author = users.get(obj.last_author_id)
+
+
+def set_generations(threads):
+    """Set the cache generation of the thread fragment of threads at once."""
+    threads = list(threads)
+    generations = iter(get_generations(
+        pair for t in threads for pair in (('thread', t.pk),
+                                           ('user', t.author_id),
+                                           ('category', t.category_id))))
+    for t in threads:
+        t.generation = '{}.{}.{}'.format(*(next(generations)
+                                           for i in range(3)))
+
+
+def get_contributors(thread_ids):
+    """Return {thread pk: frozenset of contributor ids} with a single cache
+    lookup, caching the missing sets."""
+    keys = {CONTRIBUTORS_KEY.format(pk): pk for pk in set(thread_ids)}
+    contributors = {keys[key]: ids
+                    for key, ids in cache.get_many(keys).items()}
+    missing = {pk: set() for pk in keys.values() if pk not in contributors}
+    if missing:
+        for thread, user in Thread.contributors.through.objects\
+                .filter(thread__in=missing)\
+                .values_list('thread', 'forumuser'):
+            missing[thread].add(user)
+        found = {pk: frozenset(ids) for pk, ids in missing.items()}
+        cache.set_many({CONTRIBUTORS_KEY.format(pk): ids
+                        for pk, ids in found.items()}, None)
+        contributors.update(found)
+    return contributors
+
+
+def add_contributor(thread, user_id):
+    """Add user_id to the contributors of thread, skipping the insert when
+    already there."""
+    contributors = get_contributors([thread.pk])[thread.pk]
+    if user_id in contributors:
+        return
+    thread.contributors.add(user_id)
+    # A concurrent new contributor may be lost from the set, and is then
+    # added again on their next post
+    cache.set(CONTRIBUTORS_KEY.format(thread.pk), contributors | {user_id},
+              None)
+
+
+def flush_views(chunk_size=VIEWS_CHUNK_SIZE):
+    """Add pending views to Thread.viewCount, return the threads updated, or
+    None if another flush is running, which would count the same views."""
+    if not cache.add(VIEWS_LOCK_KEY, True, VIEWS_LOCK_TIMEOUT):
+        return None
+    try:
+        return _flush_views(chunk_size)
+    finally:
+        cache.delete(VIEWS_LOCK_KEY)
+
+
+def _flush_views(chunk_size):
+    head = cache.get(VIEWS_LOG_KEY, 0)
+    tail = cache.get(VIEWS_FLUSHED_KEY, 0)
+    log_keys = ['{}/{}'.format(VIEWS_LOG_KEY, i)
+                for i in range(tail + 1, head + 1)]
+    thread_ids = set(cache.get_many(log_keys).values())
+    keys = {VIEWS_KEY.format(pk): pk for pk in thread_ids}
+    views = {keys[key]: count
+             for key, count in cache.get_many(keys).items() if count > 0}
+    pks = sorted(views)
+    for i in range(0, len(pks), chunk_size):
+        chunk = pks[i:i + chunk_size]
+        Thread.objects.filter(pk__in=chunk).update(
+            viewCount=F('viewCount') + Case(
+                *[When(pk=pk, then=Value(views[pk])) for pk in chunk],
+                default=Value(0)))
+        for pk in chunk:
+            # Views counted since the get_many stay pending
+            try:
+                if cache.decr(VIEWS_KEY.format(pk), views[pk]) > 0:
+                    log_views(pk)
+            except ValueError:  # Evicted meanwhile, nothing left pending
+                pass
+    cache.set(VIEWS_FLUSHED_KEY, head, None)
+    cache.delete_many(log_keys)
+    return len(pks)
+
+
 # Model signal handlers
 @receiver(post_save, sender=Post)
 def update_post_cache(created, instance, **kwargs):
-    html = render(instance.content_plain, "bbcode")
-    cache.set("post/{}/html".format(instance.pk), html, None)
-    if created:
-        cache.set("thread/{}/contributors".format(instance.thread.pk),
-                  instance.thread.contributors.all(), None)
-        cache.set('thread/{}/latest_post'.format(instance.thread.pk),
-                  instance, None)
+    instance.update_html()
 
 
-@receiver(post_save, sender=Post)
-def update_thread_cache(created, instance, **kwargs):
-    cache.delete(make_template_fragment_key('thread', [instance.thread.pk]))
+@receiver(m2m_changed, sender=Thread.contributors.through)
+def update_contributors_cache(instance, action, reverse, pk_set, **kwargs):
+    """Drop the cached contributors of threads changed elsewhere, e.g. in
+    the admin."""
+    if action.startswith('post_'):
+        pks = (pk_set or ()) if reverse else [instance.pk]
+        cache.delete_many([CONTRIBUTORS_KEY.format(pk) for pk in pks])
+
+
+@receiver(post_save, sender=Category)
+def update_category_cache(instance, **kwargs):
+    bump_generation('category', instance.pk)
 
 
 @receiver(post_save, sender=Thread)
 def update_thread_cache(created, instance, **kwargs):
-    cache.delete(make_template_fragment_key('thread', [instance.pk]))
+    bump_generation('thread', instance.pk)
 
 
-@receiver(post_save, sender=Post)
-def update_post_count(created, instance, **kwargs):
-    if created:
-        category = instance.thread.category.pk
-        thread = instance.thread.pk
-        cache.set(f"category/{category}/post_count",
-                  Post.objects.filter(thread__category__pk=category).count(),
-                  None)
-        cache.set(f"thread/{thread}/post_count",
-                  instance.thread.posts.count() - 1,
-                  None)
+@receiver(post_save, sender=PollQuestion)
+def update_poll_thread_cache(instance, **kwargs):
+    bump_generation('thread', instance.thread_id)
 
 
 @receiver(post_save, sender=Post)
 def add_user_mentions(created, instance, **kwargs):
-    for user in UserReferences(instance.content_plain).get_users():
-        obj, created = UserMentions.objects.get_or_create(user=user, post=instance)
-        if created:
-            user.newMention = True
-            user.save()
-        # logger.warning(obj)
+    references = instance.user_references
+    if references.mentions_all:
+        user_ids = ForumUser.objects.order_by('pk')\
+                            .values_list('pk', flat=True)
+    else:
+        user_ids = [user.pk for user in references.users]
+    if not created:  # Users already mentioned in this post were notified
+        notified = set(UserMentions.objects.filter(post=instance)
+                                           .values_list('user', flat=True))
+        user_ids = [pk for pk in user_ids if pk not in notified]
+    bulk_add_mentions(instance, list(user_ids))
 
 
 @receiver(post_save, sender=Thread)
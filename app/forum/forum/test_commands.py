@@ -0,0 +1,41 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
+
+from user.models import BOOKMARK_KEY, ForumUser
+from utils.renderer import RENDERER_VERSION
+from .models import Post
+from .testcases import ForumTestCase
+
+
+class WarmCacheTest(ForumTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        ForumUser.objects.filter(pk=cls.user.pk).update(
+            last_seen=timezone.now())
+        cls.post = Post.objects.create(
+            thread=cls.thread, author=cls.user, content_plain='[b]Hi[/b]')
+        Post.objects.update(content_html='', renderer_version=0)
+
+    def test_warm_cache(self):
+        call_command('warm_cache', stdout=StringIO())
+        self.assertEqual(cache.get('user/{}'.format(self.user.pk)), self.user)
+        self.assertIsNotNone(cache.get('author/{}'.format(self.user.pk)))
+        self.assertIsNotNone(
+            cache.get(BOOKMARK_KEY.format(self.user.pk, self.thread.pk)))
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.renderer_version, RENDERER_VERSION)
+        self.assertIn('<strong>Hi</strong>', post.content_html)
+
+    def test_live_values_are_kept(self):
+        key = BOOKMARK_KEY.format(self.user.pk, self.thread.pk)
+        now = timezone.now()
+        cache.set(key, now, None)
+        cache.set('user/{}'.format(self.user.pk), 'live', None)
+        call_command('warm_cache', stdout=StringIO())
+        self.assertEqual(cache.get(key), now)
+        self.assertEqual(cache.get('user/{}'.format(self.user.pk)), 'live')
@@ -0,0 +1,212 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from user.models import ForumUser, get_author_card
+from .models import VIEWS_KEY, VIEWS_LOCK_KEY, Category, Post, Thread, \
+    UserMentions, bulk_add_mentions, flush_views, get_contributors, \
+    set_cached_authors, set_generations, set_pending_views
+from .testcases import ForumTestCase
+
+
+class MentionsTest(ForumTestCase):
+    usernames = ['user{}'.format(i) for i in range(5)]
+
+    def test_mention_all(self):
+        post = Post.objects.create(thread=self.thread, author=self.users[0],
+                                   content_plain='Hello @all')
+        self.assertEqual(UserMentions.objects.filter(post=post).count(), 5)
+        self.assertEqual(ForumUser.objects.filter(newMention=True).count(), 5)
+        self.assertTrue(cache.get('user/{}'.format(self.users[4].pk))
+                        .newMention)
+
+    def test_edit_does_not_notify_again(self):
+        post = Post.objects.create(thread=self.thread, author=self.users[0],
+                                   content_plain='Hello @user1')
+        ForumUser.objects.update(newMention=False)
+        post.content_plain = 'Hello @user1 @user2'
+        post.save()
+        self.assertEqual(
+            list(ForumUser.objects.filter(newMention=True)
+                                  .values_list('username', flat=True)),
+            ['user2'])
+
+    def test_chunks(self):
+        post = Post.objects.create(thread=self.thread, author=self.users[0],
+                                   content_plain='Hello')
+        user_ids = [user.pk for user in self.users]
+        with self.assertNumQueries(9):
+            bulk_add_mentions(post, user_ids, chunk_size=2)
+        self.assertEqual(UserMentions.objects.filter(post=post).count(), 5)
+
+
+class CountersTest(ForumTestCase):
+    thread_count = 0
+
+    def test_counters(self):
+        threads = [Thread.objects.create(title='Test', author=self.user,
+                                         category=self.category)
+                   for i in range(3)]
+        for thread in threads:
+            for i in range(4):
+                post = Post.objects.create(thread=thread, author=self.user,
+                                           content_plain='Hello')
+        threads[0].visible = False
+        threads[0].save()
+        thread = Thread.objects.get(pk=threads[2].pk)
+        self.assertEqual((thread.post_count, thread.reply_count), (4, 3))
+        self.assertEqual(thread.last_post, post)
+        self.assertEqual(thread.last_author, self.user)
+        category = Category.objects.get(pk=self.category.pk)
+        self.assertEqual(category.thread_count, 2)
+        self.assertEqual(category.post_count, 12)
+        self.assertEqual(category.last_thread, thread)
+
+    def test_stale_thread_save(self):
+        thread = Thread.objects.create(title='Test', author=self.user,
+                                       category=self.category)
+        stale = Thread.objects.get(pk=thread.pk)
+        Post.objects.create(thread=thread, author=self.user,
+                            content_plain='Hello')
+        stale.viewCount += 1
+        stale.save()
+        self.assertEqual(Thread.objects.get(pk=thread.pk).post_count, 1)
+
+
+class ViewsTest(ForumTestCase):
+    thread_count = 3
+
+    def test_flush_views(self):
+        for i, thread in enumerate(self.threads):
+            for j in range(i + 1):
+                thread.add_view()
+        self.assertEqual(Thread.objects.get(pk=self.threads[2].pk)
+                         .view_count, 3)
+        with self.assertNumQueries(1):
+            self.assertEqual(flush_views(), 3)
+        threads = Thread.objects.filter(
+            pk__in=[t.pk for t in self.threads]).order_by('pk')
+        set_pending_views(threads)
+        self.assertEqual([(t.viewCount, t.view_count) for t in threads],
+                         [(1, 1), (2, 2), (3, 3)])
+        self.threads[0].add_view()
+        self.assertEqual(flush_views(), 1)
+        self.assertEqual(flush_views(), 0)
+        self.assertEqual(Thread.objects.get(pk=self.threads[0].pk)
+                         .view_count, 2)
+
+    def test_evicted_views(self):
+        for thread in self.threads:
+            thread.add_view()
+        evicted = VIEWS_KEY.format(self.threads[1].pk)
+        get_many = cache.get_many
+
+        def get_many_then_evict(keys, **kwargs):
+            values = get_many(keys, **kwargs)
+            if evicted in keys:  # By memcached, before the decr
+                cache.delete(evicted)
+            return values
+        with mock.patch.object(cache, 'get_many', get_many_then_evict):
+            self.assertEqual(flush_views(), 3)
+        self.assertEqual(flush_views(), 0)
+        self.assertEqual(
+            list(Thread.objects.filter(pk__in=[t.pk for t in self.threads])
+                 .order_by('pk').values_list('viewCount', flat=True)),
+            [1, 1, 1])
+
+    def test_overlapping_flushes(self):
+        self.threads[0].add_view()
+        cache.add(VIEWS_LOCK_KEY, True)  # Held by a running flush
+        self.assertIsNone(flush_views())
+        cache.delete(VIEWS_LOCK_KEY)
+        self.assertEqual(flush_views(), 1)
+        self.assertEqual(Thread.objects.get(pk=self.threads[0].pk).viewCount,
+                         1)
+
+
+class CachedAuthorsTest(ForumTestCase):
+    usernames = ['user{}'.format(i) for i in range(3)]
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for user in cls.users * 2:
+            Post.objects.create(thread=cls.thread, author=user,
+                                content_plain='Hello')
+
+    def test_set_cached_authors(self):
+        posts = list(Post.objects.order_by('pk'))
+        threads = list(Thread.objects.all())
+        with self.assertNumQueries(1):
+            set_cached_authors(posts + threads)
+        with mock.patch.object(cache, 'get', side_effect=AssertionError), \
+                self.assertNumQueries(0):
+            self.assertEqual([post.cached_author for post in posts],
+                             self.users * 2)
+            self.assertEqual(threads[0].cached_last_author, self.users[2])
+        with self.assertNumQueries(0):  # Now cached
+            set_cached_authors(Post(author_id=user.pk) for user in self.users)
+
+
+class GenerationsTest(ForumTestCase):
+
+    def generation(self):
+        thread = Thread.objects.get(pk=self.thread.pk)
+        set_generations([thread])
+        return thread.generation
+
+    def test_generations(self):
+        get_author_card(self.user.pk)  # Cached when the fragment rendered
+        generations = [self.generation()]
+        self.assertEqual(self.generation(), generations[-1])
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(thread=self.thread, author=self.user,
+                                content_plain='Hello')
+        generations.append(self.generation())
+        self.user.last_seen = timezone.now()
+        self.user.save()  # Not displayed in the fragment
+        self.assertEqual(self.generation(), generations[-1])
+        self.user.username = 'jacob2'
+        self.user.save()
+        generations.append(self.generation())
+        self.category.title = 'Test2'
+        self.category.save()
+        generations.append(self.generation())
+        self.assertEqual(len(set(generations)), 4)
+
+
+class ContributorsTest(ForumTestCase):
+    usernames = ['user{}'.format(i) for i in range(2)]
+    thread_count = 2
+
+    def test_contributors(self):
+        Post.objects.create(thread=self.threads[0], author=self.users[0],
+                            content_plain='Hello')
+        Post.objects.create(thread=self.threads[0], author=self.users[1],
+                            content_plain='Hello')
+        table = Thread.contributors.through._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            Post.objects.create(thread=self.threads[0], author=self.users[1],
+                                content_plain='Again')
+        self.assertFalse([q for q in queries if table in q['sql']])
+        self.assertEqual(
+            set(self.threads[0].contributors.values_list('pk', flat=True)),
+            {self.users[0].pk, self.users[1].pk})
+        cache.delete('thread/{}/contributors'.format(self.threads[0].pk))
+        with self.assertNumQueries(1):
+            contributors = get_contributors(t.pk for t in self.threads)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_contributors(t.pk for t in self.threads),
+                             contributors)
+        self.assertEqual(contributors, {
+            self.threads[0].pk: {self.users[0].pk, self.users[1].pk},
+            self.threads[1].pk: set()})
+
+    def test_changed_elsewhere(self):
+        get_contributors([self.threads[1].pk])
+        self.users[1].thread_set.add(self.threads[1])
+        self.assertEqual(get_contributors([self.threads[1].pk]),
+                         {self.threads[1].pk: {self.users[1].pk}})
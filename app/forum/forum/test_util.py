@@ -0,0 +1,81 @@
+import threading
+
+from django.contrib.postgres.search import SearchQuery
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from naxos.utils.metrics import key_family
+from .util import SEARCH_CONFIG, cached, get_search_key, get_search_query, \
+    get_snippet, parse_query
+
+
+class CachedTest(SimpleTestCase):
+
+    def setUp(self):
+        self.calls = 0
+
+    def tearDown(self):
+        cache.clear()
+
+    def compute(self, value=None):
+        def compute():
+            self.calls += 1
+            return value
+        return compute
+
+    def test_negative_caching(self):
+        self.assertIsNone(cached('test', self.compute()))
+        self.assertIsNone(cached('test', self.compute()))
+        self.assertEqual(self.calls, 1)
+
+    def test_lease(self):
+        cache.add('test:lease', True)
+        timer = threading.Timer(0.1, cache.set, ('test', 'other'))
+        timer.start()
+        self.assertEqual(cached('test', self.compute('value'), wait=5),
+                         'other')
+        timer.join()
+        self.assertEqual(self.calls, 0)
+        # The lease holder died, compute after waiting
+        cache.add('test2:lease', True)
+        self.assertEqual(cached('test2', self.compute('value'), wait=0),
+                         'value')
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(cache.get('test2:lease'))  # Not ours to release
+
+
+class SearchQueryTest(SimpleTestCase):
+
+    def test_search_query(self):
+        self.assertIsNone(get_search_query('  '))
+        self.assertEqual(
+            get_search_query('chat  "mot   de passe"'),
+            SearchQuery('chat', config=SEARCH_CONFIG) &
+            SearchQuery('mot de passe', config=SEARCH_CONFIG,
+                        search_type='phrase'))
+
+    def test_parse_query(self):
+        self.assertEqual(
+            parse_query('in:jeux cheval  by:paul by:pierre "in:quoted" x:y'),
+            ({'in': ['jeux'], 'by': ['paul', 'pierre']},
+             'cheval "in:quoted" x:y'))
+
+    def test_search_key(self):
+        self.assertEqual(
+            get_search_key('post', *parse_query('in:a in:b  Chat by:x')),
+            get_search_key('post', *parse_query('by:x chat in:b in:a')))
+        self.assertEqual(key_family(get_search_key('post', {}, 'chat')),
+                         'search/*')
+        self.assertNotEqual(get_search_key('post', {}, 'chat'),
+                            get_search_key('thread', {}, 'chat'))
+        self.assertNotEqual(get_search_key('post', {}, '"chat noir"'),
+                            get_search_key('post', {}, 'chat noir'))
+
+    def test_snippet(self):
+        self.assertEqual(get_snippet('[b]Les chats[/b] <3', 'CHAT'),
+                         'Les <mark>chats</mark> &lt;3')
+        self.assertEqual(
+            get_snippet('a ' * 20 + 'Un  Élève [i]doué[/i] ' + 'b ' * 20,
+                        'eleve "un eleve"', length=20),
+            '… a a a <mark>Un Élève</mark> doué …')
+        self.assertEqual(get_snippet('a b c d', '', length=4), 'a b …')
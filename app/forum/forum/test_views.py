@@ -0,0 +1,231 @@
+from datetime import datetime, timedelta
+from unittest import mock, skipUnless
+
+from django.core.paginator import Paginator
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from user.models import Bookmark
+from .models import Category, PollQuestion, Post, Thread, get_contributors
+from .testcases import ForumTestCase
+from .util import PositionPaginator, SeekPaginator
+from .views import get_page_number, get_post_page, get_read_status
+
+
+class PageNumberTest(TestCase):
+
+    def test_orphans(self):
+        self.assertEqual(get_page_number(0, 0, 30, 2), 1)
+        self.assertEqual(get_page_number(29, 61, 30, 2), 1)
+        self.assertEqual(get_page_number(30, 61, 30, 2), 2)
+        self.assertEqual(get_page_number(60, 61, 30, 2), 2)
+        self.assertEqual(get_page_number(60, 63, 30, 2), 3)
+
+
+class ReadStatusTest(ForumTestCase):
+    usernames = ['jacob', 'paul']
+    thread_count = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = cls.users[1]
+        cls.thread = Thread.objects.create(
+            title='Test', author=cls.other, category=cls.category)
+        cls.other_thread = Thread.objects.create(
+            title='Other', author=cls.other, category=cls.category)
+        start = timezone.now() - timedelta(days=1)
+        cls.posts = [Post.objects.create(
+            thread=cls.thread, author=cls.other, content_plain='Hello',
+            created=start + timedelta(minutes=i)) for i in range(65)]
+        Post.objects.create(thread=cls.other_thread, author=cls.user,
+                            content_plain='Hello')
+        Bookmark.objects.create(user=cls.user, thread=cls.thread)
+        Bookmark.objects.filter(user=cls.user).update(
+            timestamp=cls.posts[61].created)
+
+    def test_read_status(self):
+        get_contributors([self.thread.pk, self.other_thread.pk])
+        with self.assertNumQueries(1):
+            status = get_read_status(
+                [self.thread, self.other_thread], self.user.pk)
+        self.assertEqual(status[self.thread.pk], (self.posts[62].pk, 3, False))
+        self.assertEqual(status[self.other_thread.pk], (None, None, True))
+
+    def test_post_page(self):
+        self.assertEqual([p.position for p in self.posts], list(range(65)))
+        self.assertEqual(get_post_page(Post.objects.get(position=59)), 2)
+        self.assertEqual(get_post_page(Post.objects.get(position=60)), 3)
+
+    def test_goto_post(self):
+        self.client.force_login(self.user)
+        post = self.posts[40]
+        response = self.client.get('/forum/post/{}?goto'.format(post.pk))
+        self.assertRedirects(
+            response, '/forum/test/test/?page=2#{}'.format(post.pk),
+            fetch_redirect_response=False)
+
+
+class PaginationTest(ForumTestCase):
+    thread_count = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        for i in range(70):
+            Thread.objects.create(
+                title='Thread {}'.format(i), author=cls.user,
+                category=cls.category, isSticky=i % 20 == 0,
+                modified=now - timedelta(minutes=i // 3))
+        cls.thread = Thread.objects.first()
+        for i in range(65):
+            Post.objects.create(thread=cls.thread, author=cls.user,
+                                content_plain='Post {}'.format(i))
+
+    def test_seek_paginator(self):
+        queryset = self.category.threads.all()
+        paginator = Paginator(queryset, 10, orphans=2)
+        self.category.refresh_from_db()
+
+        def seek(number, **keys):
+            page = SeekPaginator(
+                queryset, 10, self.category.thread_count,
+                key=Thread._meta.ordering, orphans=2, **keys).page(number)
+            self.assertEqual(page.object_list,
+                             list(paginator.page(number).object_list))
+            return page
+        pages = {number: seek(number) for number in paginator.page_range}
+        for number, page in pages.items():
+            for target in (number - 2, number - 1):
+                if target >= 1:
+                    seek(target, before=page.before_key)
+            for target in (number + 1, number + 2):
+                if target <= paginator.num_pages:
+                    seek(target, after=page.after_key)
+        seek(3, after='garbage', before='1:nope')
+
+    def test_position_paginator(self):
+        queryset = self.thread.posts.all()
+        paginator = Paginator(queryset, 30, orphans=2)
+        positions = PositionPaginator(queryset, 30, 65, orphans=2)
+        self.assertEqual(positions.num_pages, 3)
+        for number in paginator.page_range:
+            self.assertEqual(list(positions.page(number).object_list),
+                             list(paginator.page(number).object_list))
+
+
+class SearchFiltersTest(ForumTestCase):
+    usernames = ['jacob', 'Paul']
+    thread_count = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.categories = [Category.objects.create(slug=slug, title=slug)
+                          for slug in ['jeux', 'divers']]
+        cls.threads = [Thread.objects.create(
+            title='Sujet {}'.format(i), author=cls.users[i % 2],
+            category=cls.categories[i // 2]) for i in range(4)]
+        cls.posts = [Post.objects.create(
+            thread=t, author=cls.user, content_plain='Hello',
+            created=timezone.make_aware(datetime(2020, 1, i + 1)))
+            for i, t in enumerate(cls.threads)]
+        PollQuestion.objects.create(question_text='?', thread=cls.threads[3])
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def search(self, query):
+        response = self.client.get('/forum/search/', {'q': query})
+        return list(response.context['object_list'])
+
+    def test_threads(self):
+        self.assertEqual(self.search('in:jeux by:paul'), [self.threads[1]])
+        self.assertEqual(self.search('in:jeux in:divers has:poll'),
+                         [self.threads[3]])
+        self.assertEqual(self.search('thread:{}'.format(self.threads[2].pk)),
+                         [self.threads[2]])
+        self.assertEqual(self.search('in:nowhere'), [])
+
+    def test_posts(self):
+        self.assertEqual(
+            self.search('post:after:2020-01-02 before:2020-01-04'),
+            [self.posts[2], self.posts[1]])
+        self.assertEqual(
+            self.search('post:thread:{}'.format(self.threads[0].slug)),
+            [self.posts[0]])
+        self.assertEqual(self.search('post:in:divers by:Paul'), [])
+
+    def test_invalid(self):
+        response = self.client.get('/forum/search/', {'q': 'after:hier'},
+                                   follow=True)
+        self.assertEqual(list(response.context['object_list']), [])
+        self.assertContains(response, 'Date invalide')
+
+    @mock.patch('forum.views.SEARCH_RESULTS_LIMIT', 3)
+    def test_cached_ids(self):
+        self.assertEqual(self.search('in:divers in:jeux'), self.threads[:0:-1])
+        Thread.objects.create(title='Nouveau', author=self.users[0],
+                              category=self.categories[0])
+        self.threads[2].visible = False
+        self.threads[2].save()
+        # Same normalized query: cached ids, less the hidden thread
+        response = self.client.get('/forum/search/',
+                                   {'q': 'in:jeux  in:divers'})
+        self.assertEqual(list(response.context['object_list']),
+                         [self.threads[3], self.threads[1]])
+        self.assertTrue(response.context['results_capped'])
+        self.assertContains(response, 'Plus de 3 résultats')
+
+
+@skipUnless(connection.vendor == 'postgresql', "Full-text search")
+class SearchTest(ForumTestCase):
+    thread_count = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.threads = [Thread.objects.create(
+            title=title, author=cls.user, category=cls.category)
+            for title in ['Les élèves', 'Mot de passe oublié', 'Autre']]
+        cls.posts = [Post.objects.create(
+            thread=cls.threads[2], author=cls.user, content_plain=content)
+            for content in ['Le chat dort', 'Les chats dorment, le chat',
+                            'Un mot de passe']]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def search(self, query):
+        response = self.client.get('/forum/search/', {'q': query})
+        return list(response.context['object_list'])
+
+    def test_titles(self):
+        self.assertEqual(self.search('eleve'), [self.threads[0]])
+        self.assertEqual(self.search('"mot de passe"'), [self.threads[1]])
+        self.assertEqual(self.search('"passe de mot"'), [])
+
+    def test_posts(self):
+        # Stemmed, best match first
+        self.assertEqual(self.search('post:chat'),
+                         [self.posts[1], self.posts[0]])
+        self.assertEqual(self.search('post:"mot de passe"'),
+                         [self.posts[2]])
+        self.assertEqual(self.search('post:'), [])
+        response = self.client.get('/forum/search/', {'q': 'post:chat'})
+        self.assertContains(
+            response, 'Les <mark>chats</mark> dorment, le <mark>chat</mark>')
+
+    def test_fragments(self):
+        self.assertEqual(self.search('lèv'), [self.threads[0]])
+        self.assertEqual(self.search('user:ACO'), self.threads[::-1])
+
+    def test_edit(self):
+        post = Post.objects.get(pk=self.posts[0].pk)
+        post.content_plain = 'Le chien dort'
+        post.save()
+        self.assertEqual(self.search('post:chien'), [self.posts[0]])
@@ -0,0 +1,33 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from user.models import ForumUser
+from .models import Category, Thread
+
+
+class ForumTestCase(TestCase):
+    """
+    Creates the users, the category and the threads shared by the tests of
+    a class once, and empties the cache around every test. Subclasses add
+    their own objects in setUpTestData.
+    """
+    usernames = ['jacob']
+    thread_count = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [ForumUser.objects.create_user(
+            username=username, email='{}@test.com'.format(username))
+            for username in cls.usernames]
+        cls.user = cls.users[0]
+        cls.category = Category.objects.create(slug='test', title='Test')
+        cls.threads = [Thread.objects.create(
+            title='Test', author=cls.user, category=cls.category)
+            for i in range(cls.thread_count)]
+        cls.thread = cls.threads[0] if cls.threads else None
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
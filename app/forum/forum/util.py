@@ -1,15 +1,31 @@
 from django.template.defaultfilters import urlize as django_urlize
+from django.contrib.postgres.search import SearchQuery, TrigramWordSimilarity
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
 from django.db.models import Q
 from django.conf import settings
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from utils.postmarkup.postmarkup import strip_bbcode
 
 from urllib.parse import quote
 
+import hashlib
 import importlib
 import re
 import os
+import time
+import unicodedata
 
 
 # Process search queries
+SEARCH_CONFIG = 'french_unaccent'  # French, ignoring accents (migration 0014)
+SEARCH_FILTERS = ('in', 'by', 'after', 'before', 'thread', 'has')
+SNIPPET_LENGTH = 240  # Characters of a post shown in its search result
+
+
 # Code from Julien Phalip: http://goo.gl/EctTVy
 def normalize_query(query_string,
                     findterms=re.compile(r'"([^"]+)"|(\S+)').findall,
@@ -25,10 +41,31 @@ def normalize_query(query_string,
             t in findterms(query_string)]
 
 
+def parse_query(query_string, filters=SEARCH_FILTERS,
+                findterms=re.compile(r'"([^"]+)"|(\S+)').findall):
+    """
+    Splits the query string in its filters, the unquoted name:value terms
+    whose name is in filters, and the remaining text for normalize_query.
+    Example:
+    >>> parse_query('in:jeux cheval by:paul by:pierre "in:quoted"')
+    ({'in': ['jeux'], 'by': ['paul', 'pierre']}, 'cheval "in:quoted"')
+    """
+    parsed, text = {}, []
+    for quoted, term in findterms(query_string):
+        name, colon, value = term.partition(':')
+        if not quoted and colon and value and name in filters:
+            parsed.setdefault(name, []).append(value)
+        else:
+            text.append('"{}"'.format(quoted) if quoted else term)
+    return parsed, ' '.join(text)
+
+
 def get_query(query_string, search_fields):
     """
     Returns a query, that is a combination of Q objects. That combination
     aims to search keywords within a model by testing the given search fields.
+    The icontains lookups are served by the pg_trgm indexes on UPPER(field)
+    of the fields which have one.
     """
     query = None  # Query to search for every search term
     terms = normalize_query(query_string)
@@ -47,6 +84,286 @@ def get_query(query_string, search_fields):
     return query
 
 
+def get_similarity(query_string, field):
+    """
+    Returns how closely field matches the keywords of the query string, to
+    order the results of get_query best first.
+    """
+    return TrigramWordSimilarity(' '.join(normalize_query(query_string)),
+                                 field)
+
+
+def get_search_query(query_string):
+    """
+    Returns a full-text query matching every keyword of the query string,
+    keywords grouped by quotes being searched as phrases.
+    """
+    query = None
+    for term in normalize_query(query_string):
+        q = SearchQuery(term, config=SEARCH_CONFIG,
+                        search_type='phrase' if ' ' in term else 'plain')
+        query = q if query is None else query & q
+    return query
+
+
+def fold(text):
+    """
+    Lowercase text and strip its accents, character by character so that
+    offsets in the result are offsets in text.
+    """
+    if text.isascii():
+        return text.lower()
+    return ''.join(unicodedata.normalize('NFD', c)[0].lower()[:1]
+                   for c in text)
+
+
+def get_snippet(content, query_string, length=SNIPPET_LENGTH):
+    """
+    Returns about length characters of the BBCode content, as plain text,
+    around the first keyword of the query string found in it, with the
+    words found highlighted in <mark>. Keywords match the beginning of
+    words, ignoring case and accents, as a rough equivalent of the stemming
+    of the full-text search. Takes a single pass over the text.
+    """
+    text = re.sub(r'\s+', ' ', strip_bbcode(content)).strip()
+    folded = fold(text)
+    terms = sorted({fold(term) for term in normalize_query(query_string)},
+                   key=len, reverse=True)
+    pattern = re.compile(r'\b(?:{})\w*'.format(
+        '|'.join(map(re.escape, terms))))
+    first = pattern.search(folded) if terms else None
+    start, end = 0, min(length, len(text))
+    if first:
+        start = max(0, first.start() - length // 3)
+        space = text.find(' ', start, first.start())
+        if text[start - 1:start] not in ('', ' ') and space != -1:
+            start = space + 1  # Start on a word
+        end = min(start + length, len(text))
+    space = text.rfind(' ', start, end)
+    if end < len(text) and space > start:  # End on a word
+        end = space
+    parts, position = ['… ' if start else ''], start
+    for match in pattern.finditer(folded, start, end) if first else []:
+        parts += [escape(text[position:match.start()]),
+                  '<mark>{}</mark>'.format(
+                      escape(text[match.start():match.end()]))]
+        position = match.end()
+    parts += [escape(text[position:end]), ' …' if end < len(text) else '']
+    return mark_safe(''.join(parts))
+
+
+def get_search_key(kind, filters, text):
+    """
+    Return the cache key of the results of a search of kind ('thread',
+    'post' or 'user') for its parsed filters and text, the same for every
+    spelling of the query: filter order, case and spacing of the text.
+    """
+    normalized = (kind, sorted((name, sorted(set(values)))
+                               for name, values in filters.items()),
+                  normalize_query(text.lower()))
+    return 'search/{}'.format(
+        hashlib.md5(repr(normalized).encode()).hexdigest())
+
+
+# Pagination
+class CountedPaginator(Paginator):
+    """
+    Paginator given its item count, e.g. from a counter, rather than running
+    a COUNT(*) on every page.
+    """
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+    @property
+    def count(self):
+        return self._count
+
+    def get_bounds(self, number):
+        """Return the [bottom, top) indexes of page number."""
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        return bottom, top
+
+
+class PositionPaginator(CountedPaginator):
+    """
+    Paginates objects on a dense position field (such as Post.position), so
+    that a page is an index range scan rather than an OFFSET.
+    """
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom, top = self.get_bounds(number)
+        objects = self.object_list.filter(position__gte=bottom)
+        if top < self.count:  # Last page is left open
+            objects = objects.filter(position__lt=top)
+        return self._get_page(objects, number, self)
+
+
+class SeekPaginator(CountedPaginator):
+    """
+    Seeks from the key of an object of a nearby page, rather than using an
+    OFFSET, when that key is known. Pages keep their usual numbers. Every
+    page sets after_key, the key of its last object, for the links to later
+    pages, and before_key, the key of its first object, for the links to
+    earlier ones. Keys are prefixed with the number of their page, so a page
+    further away only skips the pages in between. Without a key, pages of the
+    second half are read backwards from the end, so that ?page=last costs the
+    same as the first page.
+
+    key is a sequence of field names, prefixed with '-' for descending order,
+    uniquely ordering object_list.
+    """
+    separator = ','
+
+    def __init__(self, object_list, per_page, count, key, after=None,
+                 before=None, **kwargs):
+        super().__init__(object_list, per_page, count, **kwargs)
+        self.key = [(f.lstrip('-'), f.startswith('-')) for f in key]
+        self.after = after
+        self.before = before
+
+    def parse_key(self, value):
+        """Return the page number and the key values encoded in value, or
+        None if invalid."""
+        number, colon, value = value.partition(':')
+        values = value.split(self.separator)
+        if not number.isdigit() or len(values) != len(self.key):
+            return None
+        opts = self.object_list.model._meta
+        try:
+            return int(number), [
+                (opts.pk if name == 'pk' else opts.get_field(name))
+                .to_python(v) for (name, desc), v in zip(self.key, values)]
+        except (FieldDoesNotExist, ValidationError):
+            return None
+
+    def get_key(self, number, obj):
+        return '{}:{}'.format(number, self.separator.join(
+            str(getattr(obj, name)) for name, desc in self.key))
+
+    def seek(self, values, backwards=False):
+        """Return the query selecting objects after the given key, or before
+        it if backwards."""
+        query, equal = Q(), Q()
+        for (name, desc), value in zip(self.key, values):
+            lookup = '{}__{}'.format(name, 'lt' if desc != backwards else 'gt')
+            query |= equal & Q(**{lookup: value})
+            equal &= Q(**{name: value})
+        return query
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom, top = self.get_bounds(number)
+        after = self.parse_key(self.after) if self.after else None
+        before = self.parse_key(self.before) if self.before else None
+        if after and after[0] < number:
+            start = self.get_bounds(after[0])[1]
+            objects = list(self.object_list.filter(self.seek(after[1]))
+                           [bottom - start:top - start])
+        elif before and before[0] > number:
+            end = self.get_bounds(before[0])[0]
+            objects = list(self.object_list.reverse().filter(
+                self.seek(before[1], backwards=True))
+                [end - top:end - bottom])[::-1]
+        elif bottom > self.count - top:
+            objects = list(self.object_list.reverse()
+                           [self.count - top:self.count - bottom])[::-1]
+        else:
+            objects = list(self.object_list[bottom:top])
+        page = self._get_page(objects, number, self)
+        page.after_key = page.before_key = None
+        if objects:
+            page.after_key = self.get_key(number, objects[-1])
+            page.before_key = self.get_key(number, objects[0])
+        return page
+
+
+class IdListPaginator(CountedPaginator):
+    """
+    Paginates a list of primary keys, such as cached search results: a page
+    fetches its objects from object_list by primary key, in the list order.
+    Objects no longer in object_list are left out of their page.
+    """
+
+    def __init__(self, object_list, per_page, ids, **kwargs):
+        super().__init__(object_list, per_page, len(ids), **kwargs)
+        self.ids = ids
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom, top = self.get_bounds(number)
+        ids = self.ids[bottom:top]
+        objects = self.object_list.in_bulk(ids)
+        return self._get_page([objects[pk] for pk in ids if pk in objects],
+                              number, self)
+
+
+# Cache generations
+# Cache keys depending on an object include its generation, incremented when
+# the object changes, so that every one of them is invalidated at once.
+def generation_key(name, pk):
+    return 'gen/{}/{}'.format(name, pk)
+
+
+def get_generations(objects):
+    """Return the current generation of each (name, pk) of objects."""
+    keys = [generation_key(name, pk) for name, pk in objects]
+    generations = cache.get_many(keys)
+    for key in set(keys) - set(generations):
+        # Start from the clock, not 0, in case an old generation was evicted
+        cache.add(key, time.time_ns(), None)
+        generations[key] = cache.get(key)
+    return [generations.get(key) for key in keys]
+
+
+def bump_generation(name, pk):
+    """Invalidate the cache keys depending on the object (name, pk)."""
+    try:
+        cache.incr(generation_key(name, pk))
+    except ValueError:  # Unknown generation, so no dependent keys either
+        pass
+
+
+# Cached values
+NOT_FOUND = '<not found>'  # Cached in place of None
+LEASE_TIMEOUT = 10
+LEASE_WAIT = 1
+
+
+def cached(key, compute, timeout=None, lease_timeout=LEASE_TIMEOUT,
+           wait=LEASE_WAIT):
+    """Return the value cached under key, else compute() and cache it.
+
+    None is cached like any other value. A missing value is computed by the
+    worker taking the lease key only, the others wait up to wait seconds for
+    it before computing it themselves.
+    """
+    lease_key = '{}:lease'.format(key)
+    value = cache.get(key)
+    if value is not None:
+        return None if value == NOT_FOUND else value
+    acquired = cache.add(lease_key, True, lease_timeout)
+    if not acquired:
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = cache.get(key)
+            if value is not None:
+                return None if value == NOT_FOUND else value
+    try:
+        value = compute()
+        cache.set(key, NOT_FOUND if value is None else value, timeout)
+    finally:
+        if acquired:  # Else the lease is another worker's
+            cache.delete(lease_key)
+    return value
+
+
 # Misc
 def keygen():
     import random
@@ -4,59 +4,126 @@ from django.views.generic import View, ListView, CreateView, UpdateView,\
 from django.urls import reverse_lazy, reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.paginator import Paginator
 from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
-from django.db.models import Sum
+from django.contrib.postgres.search import SearchRank
+from django.db.models import F, OuterRef, Q, Subquery, Sum
 from django.http import HttpResponseRedirect
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
 from django.contrib import messages
 from django.utils import timezone
 from django.conf import settings
 
+import datetime
 import re
 
 # import logging
 
 # logger = logging.getLogger(__name__)
 
-from .models import BudgetRecord, Category, Thread, Post, Preview, PollQuestion, UserMentions
+from .models import BudgetRecord, Category, Thread, Post, Preview, PollQuestion, UserMentions, \
+    get_contributors, set_cached_authors, set_generations, set_pending_views
 from .forms import ThreadForm, PostForm, PollThreadForm, QuestionForm, \
     ChoicesFormSet, FormSetHelper
-from .util import get_query
+from .util import IdListPaginator, PositionPaginator, SeekPaginator, \
+    cached, get_query, get_search_key, get_search_query, get_similarity, \
+    get_snippet, parse_query
 from utils.renderer import UserReferences
-from user.models import Bookmark, CategoryTimeStamp, ForumUser
+from user.models import Bookmark, CategoryTimeStamp, get_bookmarks, \
+    get_username_index
 
 THREADVIEW_PAGINATE_BY = 30
 POSTVIEW_PAGINATE_BY = 30
+SEARCH_RESULTS_LIMIT = 1000  # Ids cached per search, hence pages reachable
+SEARCH_CACHE_TIMEOUT = 300
 
 
 # Helpers #
 def get_post_page(post):
     """
-    Return page number the post is on.
-    Let's build a paginator object and check if our post is on the expected
-    page. If not (because of PostView.paginate_orphans), return next page.
+    Return page number the post is on, from its position in the thread and
+    the thread's (cached) post count.
     """
-    queryset = Post.objects.filter(thread=post.thread)
-    page_size = PostView.paginate_by
-    paginator = Paginator(
-        queryset, page_size, orphans=PostView.paginate_orphans,
-        allow_empty_first_page=False)
-    index = queryset.filter(pk__lt=post.pk).count()
-    page_number = max(index // PostView.paginate_by, 1)
-    page = paginator.page(page_number)
-    if post in page.object_list:
-        return page_number
-    else:
-        return page_number + 1
-
-
-def get_all_users():
-    active_users = ForumUser.objects.exclude(is_active=False)\
-                     .extra(select={'username_lower': 'lower(username)'})\
-                     .order_by('username_lower')
-    return map(lambda u: f"@{u.username}", active_users)
+    return get_page_number(post.position, post.thread.post_count,
+                           PostView.paginate_by, PostView.paginate_orphans)
+
+
+def get_page_number(index, count, paginate_by, orphans):
+    """
+    Return the number of the page holding the item at index (0-based) among
+    count items, paginated like Paginator does with orphans.
+    """
+    page_number = index // paginate_by + 1
+    if page_number > 1 and count - (page_number - 1) * paginate_by <= orphans:
+        page_number -= 1  # Orphans are displayed on the previous page
+    return page_number
+
+
+def get_read_status(threads, user):
+    """
+    Return {thread pk: (first unread post pk, its page, is contributor)} for
+    the given threads, computed with a single query from the user's
+    bookmarks and the cached contributors.
+    """
+    posts = Post.objects.filter(thread=OuterRef('pk')).order_by()
+    contributors = get_contributors(t.pk for t in threads)
+    queryset = Thread.objects.filter(pk__in=[t.pk for t in threads])\
+        .annotate(bookmark_timestamp=Subquery(
+            Bookmark.objects.filter(user=user, thread=OuterRef('pk'))
+                            .values('timestamp')[:1]))\
+        .annotate(unread_post=Subquery(
+            posts.filter(created__gt=OuterRef('bookmark_timestamp'))
+                 .order_by('pk').values('pk')[:1]))\
+        .annotate(unread_position=Subquery(
+            Post.objects.filter(pk=OuterRef('unread_post'))
+                        .values('position')))\
+        .values_list('pk', 'unread_post', 'unread_position', 'post_count')
+    read_status = {}
+    for pk, unread_post, position, post_count in queryset:
+        page = get_page_number(
+            position, post_count, PostView.paginate_by,
+            PostView.paginate_orphans) if unread_post else None
+        read_status[pk] = unread_post, page, user in contributors[pk]
+    return read_status
+
+
+def get_filter_query(model, filters):
+    """
+    Return a Q object restricting a Thread or Post search to the filters
+    parsed from its query. Categories and authors are resolved to ids first,
+    so that each filter is a comparison on an indexed column which the
+    database can apply before the text predicates.
+    Raise ValueError with a message for the user if a filter is invalid.
+    """
+    thread = '' if model is Thread else 'thread__'
+    query = Q()
+    if 'in' in filters:
+        query &= Q(**{thread + 'category__in': list(
+            Category.objects.filter(slug__in=filters['in'])
+                            .values_list('pk', flat=True))})
+    if 'by' in filters:
+        index = get_username_index()
+        query &= Q(author__in=[
+            pk for name in filters['by'] for pk, username
+            in index.search(name) if username.lower() == name.lower()])
+    date_field = 'modified' if model is Thread else 'created'
+    for name, lookup in (('after', 'gte'), ('before', 'lt')):
+        for value in filters.get(name, []):
+            try:
+                day = datetime.date.fromisoformat(value)
+            except ValueError:
+                raise ValueError("Date invalide : {} (format attendu : "
+                                 "AAAA-MM-JJ).".format(value))
+            query &= Q(**{'{}__{}'.format(date_field, lookup):
+                          timezone.make_aware(datetime.datetime.combine(
+                              day, datetime.time.min))})
+    for value in filters.get('thread', []):
+        query &= Q(**{thread + ('pk' if value.isdigit() else 'slug'): value})
+    for value in filters.get('has', []):
+        if value != 'poll':
+            raise ValueError("Filtre inconnu : has:{}.".format(value))
+        query &= Q(**{thread + 'question__isnull': False})
+    return query
 
 
 def update_category_timestamp(category, user):
@@ -80,63 +147,56 @@ class ThreadStatusMixin(object):
     """Populate thread status."""
 
     def get_context_data(self, **kwargs):
-
-        def get_bookmarked_post(thread, bookmark):
-            """Return latest read post and page from bookmark timestamp."""
-            post = Post.objects\
-                       .filter(thread=thread, created__gt=bookmark)\
-                       .only('id', 'pk').first()
-            if post:
-                page = get_post_page(post)
-                return post, page
-            else:
-                return post, None
-
         user_id = self.request.user.id
         context = super().get_context_data(**kwargs)
-        bookmarks = self.request.user.cached_bookmarks
+        bookmarks = get_bookmarks(self.request.user,
+                                  [t.pk for t in context['object_list']])
+        set_cached_authors(context['object_list'])
+        set_pending_views(context['object_list'])
+        threads = []  # Threads whose status needs to be computed
         for t in context['object_list']:
             # get thread's bookmark and check if there are unread items
             b = bookmarks.get(t.pk, None)
             if b:
-                unread_items = t.modified > b
+                t.unread_items = t.modified > b
             else:
-                unread_items = (True if t.modified >
-                                self.request.user.resetDateTime else False)
+                t.unread_items = (True if t.modified >
+                                  self.request.user.resetDateTime else False)
             key = make_template_fragment_key(
                 'thread_status',
                 [t.pk, self.request.user.pk, self.request.user.resetDateTime]
             )
             cached = cache.get('read_status/{}/{}'.format(user_id, t.id))
             # check whether additional calculation is needed
-            if (key in cache and cached == 'unread' and unread_items) or \
-               (key in cache and cached == 'read' and not unread_items):
+            if (key in cache and cached == 'unread' and t.unread_items) or \
+               (key in cache and cached == 'read' and not t.unread_items):
                 continue
             else:
                 cache.delete(key)
+                threads.append(t)
+        if not threads:
+            return context
+        read_status = get_read_status(threads, user_id)
+        statuses = {}
+        for t in threads:
+            post, page, is_contributor = read_status[t.pk]
             # add bookmark and page to thread object
-            if b:
-                t.bookmark, t.page = get_bookmarked_post(t, b)
+            if bookmarks.get(t.pk, None):
+                t.bookmark = Post(pk=post) if post else None
+                t.page = page
             else:
                 t.bookmark, t.page = True, 1
-            # now check if user is a contributor in this thread
-            is_contributor = (
-                True if t.contributors.filter(id=user_id) else False
-            )
             # now we've got all the data we needed, let's choose the correct
             # status icon and behaviour
-            if unread_items:
+            if t.unread_items:
                 status = 'unread_contributor' if is_contributor else 'unread'
-                cache.set(
-                    'read_status/{}/{}'.format(user_id, t.id), 'unread', None
-                )
+                statuses['read_status/{}/{}'.format(user_id, t.id)] = 'unread'
             else:
                 status = 'read_contributor' if is_contributor else 'read'
                 t.bookmark = None
-                cache.set(
-                    'read_status/{}/{}'.format(user_id, t.id), 'read', None
-                )
+                statuses['read_status/{}/{}'.format(user_id, t.id)] = 'read'
             t.status = 'img/{}.png'.format(status)
+        cache.set_many(statuses, None)
         return context
 
 
@@ -160,7 +220,7 @@ class PreviewPostMixin(object):
 # Main Forum Views #
 class CategoryView(LoginRequiredMixin, ListView):
     """View of the different categories."""
-    model = Category
+    queryset = Category.objects.select_related('last_thread')
     context_object_name = 'categories'
 
     def get_context_data(self, **kwargs):
@@ -168,15 +228,20 @@ class CategoryView(LoginRequiredMixin, ListView):
         context['budget_total'] = BudgetRecord.objects.aggregate(Sum('amount'))['amount__sum'] or 0
         # logger.warning(context['budget_total'])
         context['budget_status'] = 'danger' if context['budget_total'] < 0 else 'success'
-        timestamps = CategoryTimeStamp.objects.filter(user=self.request.user)
+        timestamps = dict(
+            CategoryTimeStamp.objects.filter(user=self.request.user)
+                                     .values_list('category', 'timestamp'))
         for c in context['categories']:
             # to avoid non existent timestamps
-            timestamp, created = timestamps.get_or_create(
-                category=c, user=self.request.user)
+            if c.pk not in timestamps:
+                timestamp, created = CategoryTimeStamp.objects.get_or_create(
+                    category=c, user=self.request.user)
+                timestamps[c.pk] = timestamp.timestamp
             # compute and add read/unread status to category object
             c.status = 'img/{}.png'.format(
-                "unread" if c.threads.count() != 0 and
-                c.threads.latest().modified > timestamp.timestamp else "read")
+                "unread" if c.last_thread and
+                c.last_thread.modified > timestamps[c.pk] else "read")
+        set_cached_authors(c.last_thread for c in context['categories'])
         return context
 
 
@@ -184,6 +249,7 @@ class ThreadView(LoginRequiredMixin, ThreadStatusMixin, CategoryReadMixin,
                  ListView):
     paginate_by = THREADVIEW_PAGINATE_BY
     paginate_orphans = 2
+    paginator_class = SeekPaginator
 
     def get(self, request, *args, **kwargs):
         self.category = get_object_or_404(
@@ -194,15 +260,23 @@ class ThreadView(LoginRequiredMixin, ThreadStatusMixin, CategoryReadMixin,
         """Get the threads to be displayed."""
         return self.category.threads.filter(visible=True)
 
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return self.paginator_class(
+            queryset, per_page, self.category.thread_count,
+            key=Thread._meta.ordering, after=self.request.GET.get('after'),
+            before=self.request.GET.get('before'), **kwargs)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['category'] = self.category
+        set_generations(context['object_list'])
         return context
 
 
 class PostView(LoginRequiredMixin, CategoryReadMixin, ListView):
     paginate_by = POSTVIEW_PAGINATE_BY
     paginate_orphans = 2
+    paginator_class = PositionPaginator
 
     def get(self, request, *args, **kwargs):
         self.thread = get_object_or_404(
@@ -213,14 +287,12 @@ class PostView(LoginRequiredMixin, CategoryReadMixin, ListView):
         if not self.thread.visible:  # 403 if the thread has been removed
             raise PermissionDenied
         # Decide whether Post.viewCount should be incremented
-        bookmarks = request.user.cached_bookmarks
-        b = bookmarks.get(self.thread.pk, None)
+        b = get_bookmarks(request.user, [self.thread.pk]).get(self.thread.pk)
         # If b > t.modified, user has visited this thread since last post
         # (so no incr), if None, post has never been visited (so incr)
         increment = self.thread.modified > b if b else True
         if increment:
-            self.thread.viewCount += 1  # Increment views
-            self.thread.save()
+            self.thread.add_view()
         # Update thread's bookmark
         Bookmark.objects.update_or_create(
             user=request.user, thread=self.thread)
@@ -235,17 +307,32 @@ class PostView(LoginRequiredMixin, CategoryReadMixin, ListView):
         """Get the posts to be displayed."""
         return self.thread.posts.all()
 
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return self.paginator_class(
+            queryset, per_page, self.thread.post_count, **kwargs)
+
     def get_context_data(self, **kwargs):
         """Add context data for template."""
         context = super().get_context_data(**kwargs)
         context['thread'] = self.thread
-        context['users'] = get_all_users()
+        set_cached_authors(context['object_list'])
         return context
 
 
 class PostDetailView(LoginRequiredMixin, DetailView):
-    "Displays a single post"
-    model = Post
+    "Displays a single post, or redirects to it in its thread with ?goto"
+    queryset = Post.objects.select_related('thread__category')
+
+    def get(self, request, *args, **kwargs):
+        if 'goto' not in request.GET:
+            return super().get(request, *args, **kwargs)
+        post = self.get_object()
+        return HttpResponseRedirect('{}?page={}#{}'.format(
+            reverse('forum:thread', kwargs={
+                'category_slug': post.thread.category.slug,
+                'thread_slug': post.thread.slug}),
+            get_post_page(post),
+            post.pk))
 
 
 # Thread and Post creation and edit #
@@ -264,7 +351,6 @@ class NewThread(LoginRequiredMixin, PreviewPostMixin, CategoryReadMixin,
         context = super().get_context_data(**kwargs)
         context['category'] = self.category
         context['static_url'] = settings.STATIC_URL
-        context['users'] = get_all_users()
         return context
 
     def get_form_kwargs(self):
@@ -311,7 +397,7 @@ class NewPost(LoginRequiredMixin, PreviewPostMixin, CategoryReadMixin,
         context['thread'] = self.thread
         context['history'] = Post.objects.filter(
             thread=self.thread).order_by('-pk')[:10]
-        context['users'] = get_all_users()
+        set_cached_authors(context['history'])
         return context
 
     def get_form_kwargs(self):
@@ -356,7 +442,6 @@ class QuotePost(NewPost):
     def get_context_data(self, **kwargs):
         "Pass category and thread from url to context"
         context = super().get_context_data(**kwargs)
-        context['users'] = get_all_users()
         return context
 
 
@@ -388,7 +473,6 @@ class EditPost(LoginRequiredMixin, PreviewPostMixin, UpdateView):
         context['thread'] = self.t
         context['post'] = self.p
         context['static_url'] = settings.STATIC_URL
-        context['users'] = get_all_users()
         return context
 
     def get_form_kwargs(self):
@@ -421,18 +505,16 @@ class EditPost(LoginRequiredMixin, PreviewPostMixin, UpdateView):
 class ResetBookmarks(LoginRequiredMixin, View):
 
     def post(self, request, *args, **kwargs):
-        if kwargs['pk'] != str(request.user.pk):
+        if kwargs['pk'] != request.user.pk:
             raise PermissionDenied
         else:
-            # update all bookmark timestamps to now
-            Bookmark.objects.filter(user=request.user)\
-                .update(timestamp=timezone.now())
+            # update all bookmark timestamps to now, cached ones being
+            # compared to resetDateTime by get_bookmarks
+            now = timezone.now()
+            Bookmark.objects.filter(user=request.user).update(timestamp=now)
             # record resetDateTime on user
-            request.user.resetDateTime = timezone.now()
+            request.user.resetDateTime = now
             request.user.save()
-            # delete cached bookmarks & force re-cache
-            cache.delete('bookmark/{}'.format(request.user.pk))
-            request.user.cached_bookmarks
         return HttpResponseRedirect(reverse('forum:top'))
 
 
@@ -511,7 +593,6 @@ def NewPoll(request, category_slug):
         'question_form': question_form,
         'static_url': settings.STATIC_URL,
         'thread_form': thread_form,
-        'users': get_all_users(),
     })
 
 
@@ -543,6 +624,7 @@ def VotePoll(request, category_slug, thread_slug):
 class SearchView(LoginRequiredMixin, ThreadStatusMixin, ListView):
     paginate_by = 30
     paginate_orphans = 2
+    paginator_class = IdListPaginator
     template_name = 'forum/search_results.html'
 
     def get(self, request, *args, **kwargs):
@@ -555,29 +637,86 @@ class SearchView(LoginRequiredMixin, ThreadStatusMixin, ListView):
 
     def get_queryset(self):
         """Handle search parameters & process search computation."""
-        cls = Thread
-        if re.findall(r'^user:', self.query):
-            entry_query = get_query(self.query[5:], ['author__username'])
-        elif re.findall(r'^post:', self.query):
-            cls = Post
-            entry_query = get_query(self.query[5:], ['content_plain'])
-        else:
-            entry_query = get_query(self.query, ['title'])
-        results = cls.objects.filter(entry_query)
+        cls, query = Thread, self.query
+        if re.findall(r'^post:', query):
+            cls, query = Post, query[5:]
+        user_search = cls is Thread and re.findall(r'^user:', query)
+        if user_search:
+            query = query[5:]
+        filters, text = parse_query(query)
+        self.search_text = text
+        objects = cls.objects.all()
         if 'visible' in [field.name for field in cls._meta.fields]:
-            results = results.filter(visible="True")
-        self.results_count = results.count()
+            objects = objects.filter(visible=True)
+        kind = 'user' if user_search else cls._meta.model_name
+        try:
+            self.search_ids, self.results_capped = cached(
+                get_search_key(kind, filters, text),
+                lambda: self.search(objects, filters, text, user_search),
+                SEARCH_CACHE_TIMEOUT)
+        except ValueError as e:
+            messages.error(self.request, str(e))
+            self.search_ids, self.results_capped = [], False
+            self.results_count = 0
+            return objects.none()
+        self.results_count = len(self.search_ids)
         if not self.results_count:
             messages.error(
                 self.request,
                 'Aucun résultat ne correspond à cette recherche.'
             )
+        elif self.results_capped:
+            messages.success(
+                self.request,
+                "Plus de {} résultats trouvés.".format(self.results_count)
+            )
         else:
             messages.success(
                 self.request,
                 "{} résultat(s) trouvé(s).".format(self.results_count)
             )
-        return results
+        if cls is Post:  # Snippets are shown rather than the rendered posts
+            objects = objects.select_related('thread__category')\
+                .defer('content_html')
+        return objects
+
+    def search(self, objects, filters, text, user_search):
+        """
+        Return the ids of the first SEARCH_RESULTS_LIMIT results, best first,
+        and whether there were more.
+        """
+        cls = objects.model
+        filtered = objects.filter(get_filter_query(cls, filters))
+        search_query = get_search_query(text)
+        if user_search and text:
+            entry_query = get_query(text, ['author__username'])
+            similarity = get_similarity(text, 'author__username')
+            results = filtered.filter(entry_query)\
+                .annotate(similarity=similarity)\
+                .order_by('-similarity', '-modified')
+        elif search_query is not None:
+            # Full-text search, best matches first
+            rank = SearchRank(F('search_vector'), search_query)
+            results = filtered.filter(search_vector=search_query)\
+                .annotate(rank=rank).order_by('-rank', '-pk')
+            if cls is Thread and not results.exists():
+                # No whole word matched, look for fragments of titles
+                results = filtered.filter(get_query(text, ['title']))\
+                    .annotate(similarity=get_similarity(text, 'title'))\
+                    .order_by('-similarity', '-pk')
+        elif filters:
+            # Latest first
+            results = filtered.order_by('-modified' if cls is Thread
+                                        else '-pk')
+        else:
+            return [], False
+        ids = list(results.values_list('pk', flat=True)
+                   [:SEARCH_RESULTS_LIMIT + 1])
+        return ids[:SEARCH_RESULTS_LIMIT], len(ids) > SEARCH_RESULTS_LIMIT
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return self.paginator_class(queryset, per_page, self.search_ids,
+                                    **kwargs)
 
     def get_context_data(self, **kwargs):
         """Add context data for the template."""
@@ -586,11 +725,15 @@ class SearchView(LoginRequiredMixin, ThreadStatusMixin, ListView):
             context = super().get_context_data(**kwargs)
         else:
             context = ListView.get_context_data(self, **kwargs)
+            set_cached_authors(context['object_list'])
             for post in context['object_list']:
                 post.page = get_post_page(post)
+                post.snippet = get_snippet(post.content_plain,
+                                           self.search_text)
         context['model'] = model
         context['query'] = self.query
         context['results_count'] = self.results_count
+        context['results_capped'] = self.results_capped
         context['query_url'] = 'q=' + self.query + '&'
         return context
 
@@ -602,7 +745,7 @@ class UserMentionsView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         """Handle search parameters & process search computation."""
-        results = Post.objects\
+        results = Post.objects.select_related('thread__category')\
             .filter(mentions__user=self.request.user, thread__visible=True)\
             .order_by("-mentions__pk")
         self.request.user.newMention = False
@@ -612,6 +755,7 @@ class UserMentionsView(LoginRequiredMixin, ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        set_cached_authors(context['object_list'])
         for post in context['object_list']:
             post.page = get_post_page(post)
             # logger.warning(post.page)
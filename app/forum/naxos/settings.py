@@ -153,8 +153,14 @@ CONN_MAX_AGE = None
 # Cache
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.memcached.PyLibMCCache",
+        # Per-worker LRU in front of memcached, see naxos/utils/cache.py
+        "BACKEND": "naxos.utils.cache.TwoTierCache",
         "LOCATION": os.environ.get("CACHE_LOCATION", "memcached"),
+        "OPTIONS": {
+            "REMOTE_BACKEND": "django.core.cache.backends.memcached.PyLibMCCache",
+            "LOCAL_KEYS": r"(user|author)/\d+$",
+            "LOCAL_TIMEOUT": 5,
+        },
     }
 }
 
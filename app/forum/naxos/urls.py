@@ -14,6 +14,7 @@ urlpatterns = [
     path('', RedirectView.as_view(url=reverse_lazy('forum:top'),
          permanent=True)),
     path('version', views.get_version),
+    path('metrics', views.metrics),
     path('forum/', include('forum.urls')),
     path('user/', include('user.urls')),
     path('messages/', include('pm.urls')),
@@ -0,0 +1,300 @@
+"""Two-tier cache backend.
+
+Keys matching LOCAL_KEYS are kept in a bounded LRU shared by the threads of
+the worker, in front of the remote backend (memcached). Every write to such a
+key stores a new generation next to it in the remote backend, with the same
+timeout. A local copy is trusted for LOCAL_TIMEOUT seconds, then revalidated
+by reading its generation only, so workers see each other's writes after at
+most LOCAL_TIMEOUT seconds.
+"""
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+from .metrics import count_many, key_family
+
+_local_caches = {}
+_local_caches_lock = threading.Lock()
+
+
+class LocalLRU(object):
+    """LRU of key: (pickled value, generation, checked, size), bounded in
+    entries and in pickled bytes. Values are pickled so that each hit gets
+    its own copy, unaffected by changes made to the object once cached."""
+
+    def __init__(self, max_entries, max_size):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'revalidations': 0,
+                      'evictions': 0, 'remote_hits': 0, 'remote_misses': 0}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None:
+                self.data.move_to_end(key)
+            return entry
+
+    def set(self, key, value, generation):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        size = len(pickled)
+        if size > self.max_size:
+            self.delete(key)
+            return
+        with self.lock:
+            old = self.data.pop(key, None)
+            if old is not None:
+                self.size -= old[3]
+            self.data[key] = (pickled, generation, time.monotonic(), size)
+            self.size += size
+            while len(self.data) > self.max_entries or \
+                    self.size > self.max_size:
+                self.size -= self.data.popitem(last=False)[1][3]
+                self.stats['evictions'] += 1
+
+    def touch(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None:
+                self.data[key] = entry[:2] + (time.monotonic(),) + entry[3:]
+
+    def delete(self, key):
+        with self.lock:
+            old = self.data.pop(key, None)
+            if old is not None:
+                self.size -= old[3]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+
+class TwoTierCache(BaseCache):
+    """Per-worker LRU in front of REMOTE_BACKEND for keys matching LOCAL_KEYS.
+
+    OPTIONS, all optional besides REMOTE_BACKEND, the others being passed to
+    the remote backend:
+        REMOTE_BACKEND: dotted path of the remote backend
+        LOCAL_KEYS: regular expression of the keys also cached locally
+        LOCAL_TIMEOUT: seconds a local copy is used without revalidation
+        LOCAL_MAX_ENTRIES, LOCAL_MAX_SIZE: bounds of the LRU
+
+    Calls are counted per key family in naxos.utils.metrics.
+    """
+
+    def __init__(self, location, params):
+        params = dict(params)
+        options = dict(params.get('OPTIONS', {}))
+        backend = import_string(options.pop('REMOTE_BACKEND'))
+        self.local_keys = re.compile(options.pop('LOCAL_KEYS', r'user/\d+$'))
+        self.local_timeout = options.pop('LOCAL_TIMEOUT', 5)
+        max_entries = options.pop('LOCAL_MAX_ENTRIES', 10000)
+        max_size = options.pop('LOCAL_MAX_SIZE', 32 * 1024 * 1024)
+        params['OPTIONS'] = options
+        super().__init__(params)
+        self.remote = backend(location, params)
+        # Django creates a backend per thread, the LRU is shared by the worker
+        with _local_caches_lock:
+            self.local = _local_caches.setdefault(
+                (str(location), self.key_prefix),
+                LocalLRU(max_entries, max_size))
+
+    @staticmethod
+    def generation_key(key):
+        return '{}:gen'.format(key)
+
+    def is_local(self, key):
+        return self.local_keys.match(key) is not None
+
+    def with_generations(self, data):
+        """Add a new generation for the local keys of data, invalidating the
+        copies of the other workers."""
+        data = dict(data)
+        generations = {}
+        for key in list(data):
+            if self.is_local(key):
+                generations[key] = os.urandom(8)
+                data[self.generation_key(key)] = generations[key]
+        return data, generations
+
+    def record(self, op, keys, start, results=None, sizes=None):
+        """Count a call on keys, splitting its duration evenly."""
+        if not keys:
+            return
+        microseconds = (time.perf_counter() - start) * 1e6 / len(keys)
+        counts = {}
+
+        def add(name, value, **labels):
+            key = (name, tuple(sorted(labels.items())))
+            counts[key] = counts.get(key, 0) + value
+        for key in keys:
+            family = key_family(key)
+            add('naxos_cache_seconds_total', microseconds, family=family,
+                op=op)
+            if results is not None:
+                add('naxos_cache_gets_total', 1, family=family,
+                    result=results.get(key, 'miss'))
+            elif op == 'set':
+                add('naxos_cache_sets_total', 1, family=family)
+                add('naxos_cache_set_bytes_total', sizes[key], family=family)
+            elif op == 'delete':
+                add('naxos_cache_deletes_total', 1, family=family)
+        count_many({key: round(value) for key, value in counts.items()})
+
+    def get_many(self, keys, version=None):
+        start = time.perf_counter()
+        keys = list(keys)
+        now = time.monotonic()
+        found, stale, remote_keys = {}, {}, []
+        for key in keys:
+            entry = self.local.get((key, version)) if self.is_local(key) \
+                else None
+            if entry is None:
+                remote_keys.append(key)
+                if self.is_local(key):
+                    remote_keys.append(self.generation_key(key))
+            elif now - entry[2] < self.local_timeout:
+                found[key] = pickle.loads(entry[0])
+            else:
+                stale[key] = entry
+                remote_keys.append(self.generation_key(key))
+        values = self.remote.get_many(remote_keys, version=version) \
+            if remote_keys else {}
+        changed = []
+        for key, entry in stale.items():
+            if values.get(self.generation_key(key)) == entry[1]:
+                self.local.touch((key, version))
+                found[key] = pickle.loads(entry[0])
+            else:
+                changed.append(key)
+        if changed:
+            values.update(self.remote.get_many(
+                changed + [self.generation_key(key) for key in changed],
+                version=version))
+        fetched = [key for key in keys if key not in found]
+        for key in fetched:
+            if key in values and self.is_local(key):
+                self.local.set((key, version), values[key],
+                               values.get(self.generation_key(key)))
+        results = dict.fromkeys(found, 'local')
+        results.update((key, 'remote') for key in fetched if key in values)
+        found.update((key, values[key]) for key in fetched if key in values)
+        self.record('get', keys, start, results=results)
+        hits = len([key for key in fetched if key in values])
+        revalidated = len(stale) - len(changed)
+        with self.local.lock:
+            stats = self.local.stats
+            stats['hits'] += len(keys) - len(fetched) - revalidated
+            stats['revalidations'] += revalidated
+            stats['misses'] += len(fetched)
+            stats['remote_hits'] += hits
+            stats['remote_misses'] += len(fetched) - hits
+        return found
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version=version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        start = time.perf_counter()
+        added = self.remote.add(key, value, timeout, version=version)
+        self.record('set', [key], start, sizes={key: self.size(value)})
+        if added and self.is_local(key):
+            generation = os.urandom(8)
+            self.remote.set(self.generation_key(key), generation, timeout,
+                            version=version)
+            self.local.set((key, version), value, generation)
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        start = time.perf_counter()
+        remote_data, generations = self.with_generations(data)
+        failed = self.remote.set_many(remote_data, timeout, version=version)
+        self.record('set', list(data), start,
+                    sizes={key: self.size(value)
+                           for key, value in data.items()})
+        for key, generation in generations.items():
+            if key in failed or self.generation_key(key) in failed:
+                self.local.delete((key, version))
+            else:
+                self.local.set((key, version), data[key], generation)
+        return [key for key in failed if key in data]
+
+    def delete(self, key, version=None):
+        start = time.perf_counter()
+        if self.is_local(key):
+            self.local.delete((key, version))
+            self.remote.delete(self.generation_key(key), version=version)
+        deleted = self.remote.delete(key, version=version)
+        self.record('delete', [key], start)
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        start = time.perf_counter()
+        keys = list(keys)
+        for key in keys:
+            self.local.delete((key, version))
+        self.remote.delete_many(
+            keys + [self.generation_key(key) for key in keys
+                    if self.is_local(key)], version=version)
+        self.record('delete', keys, start)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.remote.touch(key, timeout, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, self._missing_key, version=version) is not \
+            self._missing_key
+
+    def incr(self, key, delta=1, version=None):
+        start = time.perf_counter()
+        if self.is_local(key):
+            self.local.delete((key, version))
+            self.remote.delete(self.generation_key(key), version=version)
+        try:
+            return self.remote.incr(key, delta, version=version)
+        finally:
+            self.record('incr', [key], start)
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.remote.clear()
+
+    def close(self, **kwargs):
+        self.remote.close(**kwargs)
+
+    @staticmethod
+    def size(value):
+        if isinstance(value, (str, bytes)):
+            return len(value)
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def get_stats(self):
+        """Hit and miss counts of both tiers, since the worker started."""
+        with self.local.lock:
+            stats = dict(self.local.stats)
+            return {
+                'local': {'hits': stats['hits'],
+                          'misses': stats['misses'],
+                          'revalidations': stats['revalidations'],
+                          'evictions': stats['evictions'],
+                          'entries': len(self.local.data),
+                          'size': self.local.size},
+                'remote': {'hits': stats['remote_hits'],
+                           'misses': stats['remote_misses']},
+            }
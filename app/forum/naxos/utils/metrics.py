@@ -0,0 +1,126 @@
+"""Application counters in the Prometheus text format.
+
+Each worker counts in memory and adds its counts to the cache every
+FLUSH_INTERVAL seconds, so that /metrics shows the totals of all the workers
+whichever one is scraped. Counters are reset when memcached restarts, which
+Prometheus handles like a process restart.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.contrib.sessions.backends.cached_db import KEY_PREFIX as \
+    SESSION_KEY_PREFIX
+from django.core.cache import caches
+
+FLUSH_INTERVAL = 10
+SERIES_KEY = 'metrics/series'
+HELP = {
+    'naxos_cache_gets_total': "Cache reads by key family and result",
+    'naxos_cache_sets_total': "Cache writes by key family",
+    'naxos_cache_set_bytes_total': "Pickled bytes written by key family",
+    'naxos_cache_deletes_total': "Cache deletes by key family",
+    'naxos_cache_seconds_total': "Time spent in cache calls by key family",
+    'naxos_renders_total': "Markup renders by model and reason",
+    'naxos_smiley_compiles_total': "Compilations of the smiley index",
+}
+SCALES = {'naxos_cache_seconds_total': 1e-6}  # Counted in microseconds
+HASH = re.compile(r'[0-9a-f]{16,}$')  # Such as the md5 of search keys
+
+_counters = defaultdict(int)
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def key_family(key):
+    """Group cache keys by replacing their ids and hashes with *, so that
+    the number of series stays bounded. Suffixed keys, such as the :lease
+    keys of forum.util.cached, fall in the family of their key."""
+    if key.startswith('template.cache.'):
+        return key.rsplit('.', 1)[0]  # Drop the hash of the vary_on values
+    if key.startswith(SESSION_KEY_PREFIX):
+        return SESSION_KEY_PREFIX  # Followed by the random session key
+    return '/'.join('*' if HASH.match(part) else re.sub(r'\d+', '*', part)
+                    for part in key.partition(':')[0].split('/'))
+
+
+def get_backend():
+    """The cache holding the counters, bypassing TwoTierCache."""
+    cache = caches['default']
+    return getattr(cache, 'remote', cache)
+
+
+def count(name, value=1, **labels):
+    count_many({(name, tuple(sorted(labels.items()))): value})
+
+
+def count_many(counts):
+    """Add counts, a dict (name, sorted labels tuple): value, at once."""
+    global _last_flush
+    with _lock:
+        for key, value in counts.items():
+            _counters[key] += value
+        if time.monotonic() - _last_flush < FLUSH_INTERVAL:
+            return
+        _last_flush = time.monotonic()
+    flush()
+
+
+def series_id(name, labels):
+    return hashlib.md5(repr((name, labels)).encode()).hexdigest()
+
+
+def flush():
+    """Add the counts of this worker to the totals in the cache."""
+    with _lock:
+        counters = dict(_counters)
+        _counters.clear()
+    if not counters:
+        return
+    cache = get_backend()
+    series = cache.get(SERIES_KEY) or {}
+    new = {series_id(*key): key for key in counters
+           if series_id(*key) not in series}
+    if new:
+        series.update(new)
+        cache.set(SERIES_KEY, series, None)
+    for key, value in counters.items():
+        counter_key = 'metrics/{}'.format(series_id(*key))
+        try:
+            cache.incr(counter_key, value)
+        except ValueError:
+            if not cache.add(counter_key, value, None):
+                try:
+                    cache.incr(counter_key, value)
+                except ValueError:  # Evicted meanwhile, or DummyCache
+                    pass
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"')\
+                     .replace('\n', r'\n')
+
+
+def render_metrics():
+    """Return the totals of all the workers in the Prometheus format."""
+    flush()
+    cache = get_backend()
+    series = cache.get(SERIES_KEY) or {}
+    values = cache.get_many(['metrics/{}'.format(pk) for pk in series])
+    samples = defaultdict(list)
+    for pk, (name, labels) in series.items():
+        value = values.get('metrics/{}'.format(pk))
+        if value is not None:
+            samples[name].append((labels, value * SCALES.get(name, 1)))
+    lines = []
+    for name in sorted(samples):
+        if name in HELP:
+            lines.append('# HELP {} {}'.format(name, HELP[name]))
+        lines.append('# TYPE {} counter'.format(name))
+        for labels, value in sorted(samples[name]):
+            lines.append('{}{} {}'.format(name, '{{{}}}'.format(','.join(
+                '{}="{}"'.format(k, escape(v)) for k, v in labels))
+                if labels else '', value))
+    return '\n'.join(lines) + '\n'
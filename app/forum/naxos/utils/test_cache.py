@@ -0,0 +1,67 @@
+from django.test import SimpleTestCase
+
+from .cache import LocalLRU, TwoTierCache
+
+
+def make_worker(local_timeout=60):
+    """Return a cache backend with its own LRU, as in another worker."""
+    cache = TwoTierCache('two-tier-test', {'OPTIONS': {
+        'REMOTE_BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCAL_TIMEOUT': local_timeout,
+    }})
+    cache.local = LocalLRU(3, 1024 * 1024)
+    return cache
+
+
+class TwoTierCacheTest(SimpleTestCase):
+
+    def tearDown(self):
+        make_worker().clear()
+
+    def test_local_hits(self):
+        cache = make_worker()
+        cache.set('user/1', 'jacob', None)
+        cache.set('thread/1', 'other', None)
+        cache.get('user/1')
+        cache.get('thread/1')
+        self.assertEqual(cache.remote.get('user/1'), 'jacob')
+        stats = cache.get_stats()
+        self.assertEqual(stats['local']['hits'], 1)
+        self.assertEqual(stats['remote']['hits'], 1)
+        self.assertEqual(stats['local']['entries'], 1)
+
+    def test_copies(self):
+        cache = make_worker()
+        value = {'is_active': True}
+        cache.set('user/1', value, None)
+        value['is_active'] = False
+        self.assertEqual(cache.get('user/1'), {'is_active': True})
+        cache.get('user/1')['is_active'] = False
+        self.assertEqual(cache.get('user/1'), {'is_active': True})
+
+    def test_eviction(self):
+        cache = make_worker()
+        cache.set_many({'user/{}'.format(i): i for i in range(5)}, None)
+        self.assertEqual(list(cache.local.data),
+                         [('user/2', None), ('user/3', None),
+                          ('user/4', None)])
+        self.assertEqual(cache.get('user/0'), 0)  # From remote
+        self.assertEqual(cache.get_stats()['local']['evictions'], 3)
+
+    def test_generations(self):
+        first, second = make_worker(0), make_worker(0)
+        first.set('user/1', 'jacob', None)
+        self.assertEqual(second.get('user/1'), 'jacob')
+        self.assertEqual(second.get('user/1'), 'jacob')
+        self.assertEqual(second.get_stats()['local']['revalidations'], 1)
+        first.set('user/1', 'jacob2', None)
+        self.assertEqual(second.get('user/1'), 'jacob2')
+        first.delete('user/1')
+        self.assertIsNone(second.get('user/1'))
+
+    def test_local_timeout(self):
+        first, second = make_worker(), make_worker()
+        first.set('user/1', 'jacob', None)
+        self.assertEqual(second.get('user/1'), 'jacob')
+        first.set('user/1', 'jacob2', None)
+        self.assertEqual(second.get('user/1'), 'jacob')  # Until LOCAL_TIMEOUT
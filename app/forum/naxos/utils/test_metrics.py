@@ -0,0 +1,80 @@
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from . import metrics
+from .metrics import count, flush, key_family, render_metrics
+from .test_cache import make_worker
+
+
+class MetricsTest(SimpleTestCase):
+
+    def setUp(self):
+        flush()
+        cache.clear()
+
+    def tearDown(self):
+        flush()
+        cache.clear()
+
+    def test_key_family(self):
+        self.assertEqual(key_family('user/42'), 'user/*')
+        self.assertEqual(key_family('gen/thread/7'), 'gen/thread/*')
+        self.assertEqual(key_family('thread/3/contributors'),
+                         'thread/*/contributors')
+        self.assertEqual(key_family(
+            'template.cache.thread.d41d8cd98f00b204e9800998ecf8427e'),
+            'template.cache.thread')
+        self.assertEqual(key_family(
+            'django.contrib.sessions.cached_dbk2x9q1w3e4r5t6y7u8i9'),
+            'django.contrib.sessions.cached_db')
+        self.assertEqual(key_family('search/c7b6d4e0f1a2b3c4d5e6f708192a3b4c'),
+                         'search/*')
+        self.assertEqual(key_family('search/0123456789abcdef:lease'),
+                         'search/*')
+        self.assertEqual(key_family('user/12:gen'), 'user/*')
+
+    def test_render(self):
+        count('naxos_renders_total', model='post', reason='stale')
+        count('naxos_renders_total', 2, model='post', reason='stale')
+        count('naxos_smiley_compiles_total')
+        self.assertEqual(render_metrics(), "\n".join([
+            "# HELP naxos_renders_total {}".format(
+                metrics.HELP['naxos_renders_total']),
+            "# TYPE naxos_renders_total counter",
+            'naxos_renders_total{model="post",reason="stale"} 3',
+            "# HELP naxos_smiley_compiles_total {}".format(
+                metrics.HELP['naxos_smiley_compiles_total']),
+            "# TYPE naxos_smiley_compiles_total counter",
+            "naxos_smiley_compiles_total 1",
+        ]) + "\n")
+
+    def test_workers_add_up(self):
+        count('naxos_smiley_compiles_total')
+        flush()
+        count('naxos_smiley_compiles_total', 4)
+        self.assertIn("naxos_smiley_compiles_total 5\n", render_metrics())
+
+    def test_cache_counts(self):
+        worker = make_worker()
+        worker.set('user/1', 'jacob', None)
+        worker.get_many(['user/1', 'user/2', 'thread/1'])
+        worker.delete('user/1')
+        output = render_metrics()
+        for line in [
+                'naxos_cache_gets_total{family="user/*",result="local"} 1',
+                'naxos_cache_gets_total{family="user/*",result="miss"} 1',
+                'naxos_cache_gets_total{family="thread/*",result="miss"} 1',
+                'naxos_cache_sets_total{family="user/*"} 1',
+                'naxos_cache_set_bytes_total{family="user/*"} 5',
+                'naxos_cache_deletes_total{family="user/*"} 1']:
+            self.assertIn(line + "\n", output)
+        self.assertIn('naxos_cache_seconds_total{family="user/*",op="get"}',
+                      output)
+        self.assertNotIn('metrics/', output)
+
+    def test_endpoint(self):
+        count('naxos_smiley_compiles_total')
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; version=0.0.4')
+        self.assertContains(response, "naxos_smiley_compiles_total 1")
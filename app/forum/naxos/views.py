@@ -3,6 +3,14 @@ from django.http import HttpResponse
 
 from django.conf import settings
 
+from .utils.metrics import render_metrics
+
 @login_required
 def get_version(request):
     return HttpResponse(settings.VERSION)
+
+
+def metrics(request):
+    """Counters for Prometheus, only reachable from inside the network."""
+    return HttpResponse(render_metrics(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pm', '0004_remove_message_markup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='renderer_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,10 +1,11 @@
 from django.db import models
 from django.core.exceptions import ValidationError
-from django.core.cache import cache
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
 from user.models import ForumUser
-from utils.renderer import render
+from utils.models import RenderedModel
 
 
 # PM models
@@ -31,7 +32,7 @@ class Conversation(models.Model):
         return str([user.username for user in self.participants.all()])
 
 
-class Message(models.Model):
+class Message(RenderedModel):
 
     """A message."""
     created = models.DateTimeField(default=timezone.now,
@@ -53,14 +54,6 @@ class Message(models.Model):
         self.conversation.save()
         super().save(*args, **kwargs)
 
-    @property
-    def html(self):
-        html = cache.get('message/{}/html'.format(self.pk))
-        if not html:
-            html = render(self.content_plain, "bbcode")
-            cache.set('message/{}/html'.format(self.pk), html, None)
-        return html
-
     class Meta:
         ordering = ["created"]
         # Permit thread.posts.latest in template
@@ -68,3 +61,9 @@ class Message(models.Model):
 
     def __str__(self):
         return "{:s}: {:d}".format(self.author.username, self.pk)
+
+
+# Model signal handlers
+@receiver(post_save, sender=Message)
+def update_message_html(instance, **kwargs):
+    instance.update_html()
@@ -6,7 +6,7 @@ from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 
-from user.models import ForumUser
+from user.models import get_username_index
 from .models import Conversation, Message
 from .forms import ConversationForm
 
@@ -163,13 +163,15 @@ class DeleteMessage(LoginRequiredMixin, View):
 def GetConversation(request):
     """Conversation search form"""
     if request.method == 'POST':
-        u = ForumUser.objects.exclude(username=request.user)\
-            .filter(username__istartswith=request.POST['query'])
-        if u.count() == 1:
-            c = Conversation.objects.filter(participants=request.user)\
-                .filter(participants=u.get())
-            if c.count() == 1:
-                c = c.get()
+        users = [(pk, username) for pk, username
+                 in get_username_index().search(request.POST['query'])
+                 if pk != request.user.pk]
+        if len(users) == 1:
+            pk, username = users[0]
+            c = list(Conversation.objects.filter(participants=request.user)
+                                         .filter(participants=pk)[:2])
+            if len(c) == 1:
+                c = c[0]
                 tag = '#' + str(c.messages.latest().pk)
                 return HttpResponseRedirect(
                     reverse_lazy('pm:msg', kwargs={'pk': c.pk}) + tag)
@@ -177,13 +179,13 @@ def GetConversation(request):
                 messages.error(
                     request,
                     ("Il n'existe pas de conversation avec"
-                        " cet utilisateur : {:s}.".format(u.get().username))
+                        " cet utilisateur : {:s}.".format(username))
                 )
-        elif u.count() > 1:
+        elif len(users) > 1:
             messages.error(
                 request,
                 "Plusieurs utilisateurs possibles : {:s}.".format(
-                    ", ".join([u.username for u in u]))
+                    ", ".join([username for pk, username in users]))
             )
         else:
             messages.error(request, "Aucun utilisateur trouvé.")
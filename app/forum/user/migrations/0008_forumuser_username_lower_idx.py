@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 13:36
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0007_forumuser_newmention'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='forumuser',
+            index=models.Index(django.db.models.functions.text.Lower('username'), name='user_username_lower_idx'),
+        ),
+    ]
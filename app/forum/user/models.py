@@ -1,16 +1,24 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models.functions import Lower, Upper
 from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver
 from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
 from django.utils import timezone
 
-from forum.util import keygen
+from forum.util import NOT_FOUND, bump_generation, cached, get_generations, \
+    keygen
 
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
 import datetime
 
 FORUM_INIT = timezone.make_aware(datetime.datetime(2013, 1, 1))
+BOOKMARK_KEY = 'bookmark/{}/{}'  # User and thread
+USERNAMES_GENERATION = ('usernames', 'all')
 
 
 # Model classes
@@ -53,22 +61,18 @@ class ForumUser(AbstractUser):
 
     class Meta:
         ordering = ["pk"]
+        indexes = [
+            models.Index(Lower('username'), name='user_username_lower_idx'),
+            # Substring searches, i.e. username__icontains
+            GinIndex(OpClass(Upper('username'), name='gin_trgm_ops'),
+                     name='user_username_trgm_idx'),
+        ]
 
     @property
     def is_online(self):
         key = f"user/{self.pk}/is_online"
         return bool(cache.get(key))
 
-    @property
-    def cached_bookmarks(self):
-        "Return user's bookmarks as a dict thread:timestamp"
-        bookmarks = cache.get('bookmark/{}'.format(self.pk))
-        if not bookmarks:
-            bookmarks = dict(self.bookmarks.values_list(
-                             'thread', 'timestamp'))
-            cache.set('bookmark/{}'.format(self.pk), bookmarks, None)
-        return bookmarks
-
     def save(self, *args, **kwargs):
         # Delete old logo
         try:
@@ -140,22 +144,164 @@ class TokenPool(models.Model):
         return self.token
 
 
+# Helpers
+def get_bookmarks(user, threads):
+    """
+    Return the bookmarks of user on the given thread ids, as a dict thread
+    id: timestamp. Each bookmark is cached on its own, so that saving one is
+    a single write. Resetting the bookmarks updates the database only: a
+    cached bookmark older than user.resetDateTime counts as reset then.
+    """
+    keys = {BOOKMARK_KEY.format(user.pk, thread): thread
+            for thread in threads}
+    found = cache.get_many(keys)
+    missing = [thread for key, thread in keys.items() if key not in found]
+    if missing:
+        rows = dict(Bookmark.objects.filter(user=user, thread__in=missing)
+                    .values_list('thread', 'timestamp'))
+        for thread in missing:
+            key = BOOKMARK_KEY.format(user.pk, thread)
+            found[key] = rows.get(thread, NOT_FOUND)
+            # Unless saved meanwhile
+            cache.add(key, found[key], None)
+    return {keys[key]: max(timestamp, user.resetDateTime)
+            for key, timestamp in found.items() if timestamp != NOT_FOUND}
+
+
+def get_cached_user(pk):
+    """Gets user from cache else from db and create cache"""
+    user = cached('user/{}'.format(pk),
+                  lambda: ForumUser.objects.filter(pk=pk).first())
+    if user is None:
+        raise ForumUser.DoesNotExist
+    return user
+
+
+class UsernameIndex(object):
+    """
+    Usernames sorted by their lowercase form, for prefix lookups with bisect
+    instead of the database. Built once per worker for a generation of the
+    users.
+    """
+    __slots__ = ('generation', 'keys', 'names', 'pks', 'active')
+
+    def __init__(self, generation, rows):
+        """rows are (pk, username, is_active)."""
+        self.generation = generation
+        # Sorted here too, the database collation may differ from Python's
+        rows = sorted(rows, key=lambda row: row[1].lower())
+        self.keys = [username.lower() for pk, username, active in rows]
+        self.names = [username for pk, username, active in rows]
+        self.pks = array('q', (pk for pk, username, active in rows))
+        self.active = bytes(active for pk, username, active in rows)
+
+    def search(self, prefix, active=False, limit=None):
+        """Return [(pk, username)] of the users whose username starts with
+        prefix, case-insensitively, only the active ones if active."""
+        prefix = prefix.lower()
+        results = []
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix) and \
+                (limit is None or len(results) < limit):
+            if self.active[i] or not active:
+                results.append((self.pks[i], self.names[i]))
+            i += 1
+        return results
+
+    def __len__(self):
+        return len(self.keys)
+
+
+_username_index = None
+
+
+def get_username_index():
+    """Return the UsernameIndex of the worker, rebuilt when a user was
+    created, renamed or (de)activated since."""
+    global _username_index
+    generation, = get_generations([USERNAMES_GENERATION])
+    index = _username_index
+    if index is None or index.generation != generation:
+        index = _username_index = UsernameIndex(
+            generation, ForumUser.objects.order_by(Lower('username'))
+            .values_list('pk', 'username', 'is_active'))
+    return index
+
+
+class AuthorCard(namedtuple('AuthorCard',
+                            'pk username quote logo date_joined')):
+    """What posts and threads display of their authors, cached under
+    author/{pk} instead of the whole ForumUser"""
+    __slots__ = ()
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(*(str(getattr(user, field)) if field == 'logo'
+                     else getattr(user, field) for field in cls._fields))
+
+    def __str__(self):
+        return self.username
+
+    def __eq__(self, other):
+        """Equal to the card or the ForumUser with the same pk"""
+        if isinstance(other, (AuthorCard, ForumUser)):
+            return self.pk == other.pk
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(self.pk)
+
+
+def get_author_cards(pks):
+    """Gets author cards from cache at once, caching the missing ones"""
+    keys = {'author/{}'.format(pk): pk for pk in set(pks)}
+    cards = {keys[key]: card for key, card in cache.get_many(keys).items()}
+    missing = [pk for pk in keys.values() if pk not in cards]
+    if missing:
+        found = {values[0]: AuthorCard(*values) for values in
+                 ForumUser.objects.filter(pk__in=missing)
+                                  .values_list(*AuthorCard._fields)}
+        cache.set_many({'author/{}'.format(pk): found.get(pk, NOT_FOUND)
+                        for pk in missing}, None)
+        cards.update(found)
+    return {pk: card for pk, card in cards.items() if card != NOT_FOUND}
+
+
+def get_author_card(pk):
+    return get_author_cards([pk]).get(pk)
+
+
 # Model signal handlers
 @receiver(post_save, sender=ForumUser)
 def update_user_cache(instance, **kwargs):
-    cache.set('user/{}'.format(instance.pk), instance, None)
+    user_key, card_key = 'user/{}'.format(instance.pk), \
+        'author/{}'.format(instance.pk)
+    cached_values = cache.get_many([user_key, card_key])
+    card = cached_values.get(card_key, NOT_FOUND)
+    renamed = card == NOT_FOUND or card.username != instance.username
+    if renamed:
+        bump_generation('user', instance.pk)
+    user = cached_values.get(user_key, NOT_FOUND)
+    if renamed or user == NOT_FOUND or user.is_active != instance.is_active:
+        bump_generation(*USERNAMES_GENERATION)
+    cache.set_many({'user/{}'.format(instance.pk): instance,
+                    'author/{}'.format(instance.pk):
+                        AuthorCard.from_user(instance)}, None)
 
 
 @receiver(post_save, sender=Bookmark)
 def delete_status_cache(instance, **kwargs):
+    user = get_cached_user(instance.user_id)
     key = make_template_fragment_key(
-        'thread_status',
-        [instance.thread.pk, instance.user.pk, instance.user.resetDateTime])
+        'thread_status', [instance.thread_id, user.pk, user.resetDateTime])
     cache.delete(key)
 
 
 @receiver(post_save, sender=Bookmark)
-def cache_bookmarks(instance, **kwargs):
-    bookmarks = dict(instance.user.bookmarks.values_list(
-                     'thread', 'timestamp'))
-    cache.set('bookmark/{}'.format(instance.user.pk), bookmarks, None)
+def cache_bookmark(instance, **kwargs):
+    cache.set(BOOKMARK_KEY.format(instance.user_id, instance.thread_id),
+              instance.timestamp, None)
@@ -0,0 +1,102 @@
+import pickle
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from forum.testcases import ForumTestCase
+from .models import Bookmark, ForumUser, UsernameIndex, get_author_card, \
+    get_bookmarks, get_username_index
+
+
+class BookmarksTest(ForumTestCase):
+    thread_count = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.pks = [t.pk for t in cls.threads]
+
+    def test_bookmarks(self):
+        bookmarks = get_bookmarks(self.user, self.pks)
+        self.assertEqual(sorted(bookmarks), self.pks)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_bookmarks(self.user, self.pks), bookmarks)
+        Bookmark.objects.filter(thread=self.threads[2]).delete()
+        cache.clear()
+        get_bookmarks(self.user, self.pks)
+        with self.assertNumQueries(0):  # Missing bookmarks are cached too
+            self.assertEqual(sorted(get_bookmarks(self.user, self.pks)),
+                             self.pks[:2])
+
+    def test_save(self):
+        get_bookmarks(self.user, self.pks)
+        # Saved by another worker in between: only its own entry changes
+        for thread in self.threads[:2]:
+            Bookmark.objects.update_or_create(user=self.user, thread=thread)
+        saved = dict(Bookmark.objects.values_list('thread', 'timestamp'))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_bookmarks(self.user, self.pks), saved)
+
+    def test_reset(self):
+        get_bookmarks(self.user, self.pks)
+        self.client.force_login(self.user)
+        self.client.post('/forum/reset_bookmarks/{}'.format(self.user.pk))
+        user = ForumUser.objects.get(pk=self.user.pk)
+        self.assertEqual(get_bookmarks(user, self.pks),
+                         dict.fromkeys(self.pks, user.resetDateTime))
+
+
+class AuthorCardTest(TestCase):
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_author_card(self):
+        user = ForumUser.objects.create_user(
+            username='jacob', email='jacob@test.com', quote='Hello')
+        cache.clear()
+        with self.assertNumQueries(1):
+            card = get_author_card(user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_author_card(user.pk), card)
+        self.assertEqual(card, user)
+        self.assertEqual((str(card), card.quote, card.logo),
+                         ('jacob', 'Hello', ''))
+        self.assertLess(len(pickle.dumps(card)), len(pickle.dumps(user)) / 3)
+        user.quote = 'Bye'
+        user.save()
+        self.assertEqual(get_author_card(user.pk).quote, 'Bye')
+
+
+class UsernameIndexTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_search(self):
+        index = UsernameIndex(1, [(1, 'jacob', True), (2, 'Jane', True),
+                                  (3, 'paul', True), (4, 'joe', False)])
+        self.assertEqual(index.search('J'),
+                         [(1, 'jacob'), (2, 'Jane'), (4, 'joe')])
+        self.assertEqual(index.search('j', active=True, limit=1),
+                         [(1, 'jacob')])
+        self.assertEqual(index.search('ja', active=True),
+                         [(1, 'jacob'), (2, 'Jane')])
+        self.assertEqual(index.search('z'), [])
+        self.assertEqual(len(index.search('')), 4)
+
+    def test_refresh(self):
+        user = ForumUser.objects.create_user(username='jacob',
+                                             email='jacob@test.com')
+        get_username_index()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_username_index().search('ja'),
+                             [(user.pk, 'jacob')])
+        user.username = 'paul'
+        user.save()
+        self.assertEqual(get_username_index().search('ja'), [])
+        self.assertEqual(get_username_index().search('PA'),
+                         [(user.pk, 'paul')])
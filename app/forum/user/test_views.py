@@ -0,0 +1,35 @@
+from forum.testcases import ForumTestCase
+
+
+class UsernamesTest(ForumTestCase):
+    usernames = ['jacob', 'Jane', 'paul', 'joe']
+    thread_count = 0
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_prefix(self):
+        response = self.client.get('/user/usernames/', {'q': '@J'})
+        self.assertEqual(response.json(), ['jacob', 'Jane', 'joe'])
+        response = self.client.get('/user/usernames/')
+        self.assertEqual(response.json(), ['jacob', 'Jane', 'joe', 'paul'])
+
+    def test_etag(self):
+        etag = self.client.get('/user/usernames/')['ETag']
+        with self.assertNumQueries(1):  # The session user
+            response = self.client.get('/user/usernames/',
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.users[2].username = 'peter'
+        self.users[2].save()
+        response = self.client.get('/user/usernames/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('peter', response.json())
+        etag = response['ETag']
+        self.users[3].is_active = False
+        self.users[3].save()
+        response = self.client.get('/user/usernames/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertNotIn('joe', response.json())
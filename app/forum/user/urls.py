@@ -11,6 +11,7 @@ urlpatterns = [
     path('', views.UpdateUser.as_view(), name='profile'),
     path('password/', views.UpdatePassword, name='password'),
     path('members/', views.MemberList.as_view(), name='members'),
+    path('usernames/', views.usernames, name='usernames'),
     path('top10/', view=views.Top10.as_view(), name='top10'),
     path('budget/', views.BudgetView.as_view(), name='budget'),
     path('budget/+', views.NewBudgetRecord.as_view(), name='new_budget_record'),
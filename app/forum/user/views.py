@@ -4,20 +4,23 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login as auth_login, update_session_auth_hash
 from django.http import HttpResponse, HttpResponseRedirect, \
-    HttpResponseServerError
+    HttpResponseServerError, JsonResponse
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
 from django.shortcuts import render
 from django.contrib import messages
 from django.utils import timezone
 from django.core.cache import cache
-from django.core.cache.utils import make_template_fragment_key
 from django.contrib.sessions.models import Session
+from django.utils.cache import get_conditional_response
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Count
 
 from .forms import RegisterForm, UpdateUserForm, CrispyPasswordForm, BudgetRecordForm
-from .models import ForumUser
-from forum.models import BudgetRecord, Thread
+from .models import ForumUser, get_username_index
+from forum.models import BudgetRecord, Thread, set_cached_authors, \
+    set_generations, set_pending_views
+
+USERNAMES_LIMIT = 10
 
 
 class Register(CreateView):
@@ -48,9 +51,6 @@ class UpdateUser(LoginRequiredMixin, UpdateView):
             t.author, p.author = self.request.user, self.request.user
             t.save()
             p.save()
-            # Update thread cache to reflect author's change
-            key = make_template_fragment_key('thread', [t.pk])
-            cache.delete(key)
         return super().form_valid(form)
 
     def get_success_url(self):
@@ -96,9 +96,14 @@ class Top10(LoginRequiredMixin, TemplateView):
     template_name = "user/top10.html"
 
     def dispatch(self, request, *args, **kwargs):
-        threads = Thread.objects.annotate(p_count=Count("posts"))
-        self.top_views = threads.order_by("-viewCount")[:10]
-        self.top_posts = threads.order_by("-p_count")[:10]
+        self.top_views = Thread.objects.select_related("category")\
+            .order_by("-viewCount")[:10]
+        self.top_posts = Thread.objects.select_related("category")\
+            .order_by("-post_count")[:10]
+        set_cached_authors([*self.top_views, *self.top_posts])
+        set_generations([*self.top_views, *self.top_posts])
+        set_pending_views(self.top_views)
+        set_pending_views(self.top_posts)
         return super().dispatch(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
@@ -137,6 +142,25 @@ class NewBudgetRecord(LoginRequiredMixin, CreateView):
         return reverse_lazy('user:budget')
 
 
+@login_required
+@cache_control(private=True, no_cache=True)
+def usernames(request):
+    """
+    Usernames of the active users for mention autocompletion, starting with
+    q when given. Clients revalidate with the index generation as ETag.
+    """
+    index = get_username_index()
+    etag = '"{}"'.format(index.generation)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(
+            [name for pk, name in index.search(
+                request.GET.get('q', '').lstrip('@'), active=True,
+                limit=USERNAMES_LIMIT)], safe=False)
+    response['ETag'] = etag
+    return response
+
+
 # Set disconnection timestamp
 @csrf_exempt
 def node_api(request):
@@ -0,0 +1,93 @@
+import re
+import time
+from subprocess import getoutput
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from forum.models import Post
+from utils.renderer import ExcludeTagsHTMLFilter, SPECIAL_SMILEYS, \
+    get_smiley_index, render_bbcode, reload_smileys, rm_legacy_tags, \
+    UserReferences
+
+
+def legacy_compile_smileys():
+    "Smiley compilation as done before the smiley index"
+    smileys = getoutput(
+        "ls " + settings.STATICFILES_DIRS[0] + "/img/smileys/")
+    smileys = [smiley[:-len(".gif")] for smiley in smileys.split("\n")]
+    double_colon = filter(lambda s: not s.startswith("special-"), smileys)
+    all_smileys = (
+        [(r":-?\/", "bof")] +
+        [(":" + re.escape(s) + ":", s) for s in double_colon] +
+        SPECIAL_SMILEYS
+    )
+    return [(re.compile(smiley), name) for smiley, name in all_smileys]
+
+
+def legacy_smiley_replacer(text):
+    for smiley, name in legacy_compile_smileys():
+        tag = "<img class=\"smiley\" src=\"{:s}img/smileys/{:s}.gif\">"\
+                    .format(settings.STATIC_URL, quote(name))
+        text = smiley.sub(tag, text)
+    return text
+
+
+def index_smiley_replacer(text):
+    return get_smiley_index().sub(text)
+
+
+def smilify_with(replacer, html):
+    parser = ExcludeTagsHTMLFilter(replacer)
+    parser.feed(html)
+    smiled_html = parser.html
+    parser.close()
+    return smiled_html
+
+
+class Command(BaseCommand):
+    help = "Compare legacy and indexed smiley replacement on real posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=500,
+                            help="Number of latest posts to use as corpus")
+        parser.add_argument('--rounds', type=int, default=3)
+
+    def handle(self, *args, **options):
+        contents = Post.objects.order_by('-pk')\
+            .values_list('content_plain', flat=True)[:options['posts']]
+        # Smilify operates on rendered BBCode, do the rest of render() once
+        corpus = [render_bbcode(UserReferences(rm_legacy_tags(c)).render(),
+                                cosmetic_replace=False)
+                  for c in contents]
+        if not corpus:
+            self.stderr.write("No post to benchmark against.")
+            return
+        self.stdout.write("Corpus: {} posts, {} characters".format(
+            len(corpus), sum(len(html) for html in corpus)))
+
+        start = time.perf_counter()
+        reload_smileys()
+        get_smiley_index()
+        self.stdout.write("Index build: {:.2f} ms".format(
+            (time.perf_counter() - start) * 1000))
+
+        results = {}
+        for label, replacer in (("legacy", legacy_smiley_replacer),
+                                ("index", index_smiley_replacer)):
+            timings = []
+            for _ in range(options['rounds']):
+                start = time.perf_counter()
+                output = [smilify_with(replacer, html) for html in corpus]
+                timings.append(time.perf_counter() - start)
+            results[label] = output
+            best = min(timings)
+            self.stdout.write("{:<8s} best of {}: {:.3f} s ({:.3f} ms/post)"
+                              .format(label, options['rounds'], best,
+                                      best * 1000 / len(corpus)))
+
+        mismatches = sum(1 for old, new in zip(results["legacy"],
+                                               results["index"])
+                         if old != new)
+        self.stdout.write("Posts rendered differently: {}".format(mismatches))
@@ -0,0 +1,70 @@
+import time
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Case, Q, Value, When
+
+from forum.models import Post
+from pm.models import Message
+from utils.renderer import RENDERER_VERSION, render
+
+MODELS = {'post': Post, 'message': Message}
+
+
+def render_row(row):
+    pk, content_plain = row
+    return pk, render(content_plain, 'bbcode')
+
+
+class Command(BaseCommand):
+    help = "Re-render html stamped with an outdated renderer version"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=MODELS, action='append',
+                            help="Model to re-render (default: all)")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--processes', type=int, default=None,
+                            help="Rendering processes (default: CPU count, "
+                                 "0 to render in this process)")
+
+    def handle(self, *args, **options):
+        pool = None
+        if options['processes'] != 0:
+            # Forked workers must not share the parent's database connections
+            connections.close_all()
+            pool = Pool(options['processes'])
+        try:
+            for name in options['model'] or MODELS:
+                self.rerender(MODELS[name], pool, options['batch_size'])
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    def rerender(self, model, pool, batch_size):
+        stale = model.objects.exclude(renderer_version=RENDERER_VERSION)\
+            .order_by('pk')
+        total, done, last_pk = stale.count(), 0, 0
+        start = time.perf_counter()
+        while True:
+            rows = list(stale.filter(pk__gt=last_pk)
+                        .values_list('pk', 'content_plain')[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            html = dict(pool.imap(render_row, rows, chunksize=20)
+                        if pool else map(render_row, rows))
+            # Rows edited meanwhile were rendered on save, leave them as is
+            unchanged = Q()
+            for pk, content_plain in rows:
+                unchanged |= Q(pk=pk, content_plain=content_plain)
+            done += stale.filter(unchanged).update(
+                content_html=Case(*[When(pk=pk, then=Value(value))
+                                    for pk, value in html.items()]),
+                renderer_version=RENDERER_VERSION)
+            self.stdout.write("{}: {}/{} ({:.1f} s)".format(
+                model._meta.verbose_name_plural, done, total,
+                time.perf_counter() - start))
+        self.stdout.write(self.style.SUCCESS("{}: {} re-rendered".format(
+            model._meta.verbose_name_plural, done)))
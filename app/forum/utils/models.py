@@ -0,0 +1,45 @@
+from django.db import models
+
+from naxos.utils.metrics import count
+
+from .renderer import RENDERER_VERSION, UserReferences, render
+
+
+# Abstract models
+class RenderedModel(models.Model):
+    """
+    Stores the html rendering of content_plain along with the version of the
+    renderer which produced it. Stale html is re-rendered on first access.
+    """
+    content_html = models.TextField(blank=True, editable=False)
+    renderer_version = models.PositiveSmallIntegerField(default=0,
+                                                        editable=False)
+
+    @property
+    def user_references(self):
+        "References of the current content, so that users are resolved once"
+        references = getattr(self, '_user_references', None)
+        if references is None or references.text != self.content_plain:
+            references = self._user_references = UserReferences(
+                self.content_plain)
+        return references
+
+    @property
+    def html(self):
+        if self.renderer_version != RENDERER_VERSION:
+            self.update_html(reason='stale')
+        return self.content_html
+
+    def update_html(self, reason='save'):
+        "Render content and store it without going through save()"
+        count('naxos_renders_total', model=self._meta.model_name,
+              reason=reason)
+        self.content_html = render(self.content_plain, 'bbcode',
+                                   references=self.user_references)
+        self.renderer_version = RENDERER_VERSION
+        self.__class__.objects.filter(pk=self.pk).update(
+            content_html=self.content_html,
+            renderer_version=self.renderer_version)
+
+    class Meta:
+        abstract = True
@@ -1,5 +1,7 @@
 from html.parser import HTMLParser
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
 from urllib.parse import quote
 
@@ -7,6 +9,8 @@ import re
 import os
 import markdown
 
+from naxos.utils.metrics import count
+
 from .postmarkup.postmarkup import create, SimpleTag
 from .extra_tags import CustomImgTag, SpoilerTag, VideoTag
 from user.models import ForumUser
@@ -83,44 +87,88 @@ class ExcludeTagsHTMLFilter(HTMLFilter):
 
 
 # Smiley stuff
-def compile_smileys():
-
-    special_smileys = [
-        (r":-?\)", "special-smile"),
-        (r";-?\)", "special-wink"),
-        (r":-?\(", "special-sad"),
-        (r":o", "-o"),
-        (r":-?D", "green"),
-        (r":-?v", "v"),
-        (r":\?:", "special-question"),
-        (r":\?\?\?:", "special-3question"),
-        (r":jap:", "respect"),
-        (r":clap:", "bravo"),
-    ]
-
-    def get_smileys(path):
-        "Get all smileys"
-        from subprocess import getoutput
-        smileys = getoutput("ls " + path + "/img/smileys/")
-        return [smiley[:-len(".gif")] for smiley in smileys.split("\n")]
-
-    smileys = get_smileys(settings.STATICFILES_DIRS[0])
+SPECIAL_SMILEYS = [
+    (r":-?\)", "special-smile"),
+    (r";-?\)", "special-wink"),
+    (r":-?\(", "special-sad"),
+    (r":o", "-o"),
+    (r":-?D", "green"),
+    (r":-?v", "v"),
+    (r":\?:", "special-question"),
+    (r":\?\?\?:", "special-3question"),
+    (r":jap:", "respect"),
+    (r":clap:", "bravo"),
+]
+
+
+def get_smileys(path):
+    "Get all smiley names from the static directory"
+    smileys_dir = os.path.join(path, "img", "smileys")
+    return sorted(smiley[:-len(".gif")] for smiley in os.listdir(smileys_dir)
+                  if smiley.endswith(".gif"))
+
+
+def compile_smileys(smileys):
+    "Return (pattern, name) pairs, highest priority first"
     double_colon = filter(lambda s: not s.startswith("special-"), smileys)
-    all_smileys = (
+    return (
         [(r":-?\/", "bof")] +  # 1st to avoid replacing other smileys' http://
         [(":" + re.escape(s) + ":", s) for s in double_colon] +
-        special_smileys
+        SPECIAL_SMILEYS
     )
 
-    return [(re.compile(smiley), name) for smiley, name in all_smileys]
+
+class SmileyIndex:
+
+    """
+    Every smiley combined into a single alternation, so that a text node is
+    scanned once whatever the number of smileys. Replacements are never
+    rescanned, hence inserted tags can't be smilified again.
+    """
+
+    def __init__(self, smileys):
+        all_smileys = compile_smileys(smileys)
+        self.pattern = re.compile(
+            "|".join("({:s})".format(smiley) for smiley, name in all_smileys))
+        self.tags = [
+            "<img class=\"smiley\" src=\"{:s}img/smileys/{:s}.gif\">".format(
+                settings.STATIC_URL, quote(name))
+            for smiley, name in all_smileys]
+
+    def __replace(self, matchobj):
+        return self.tags[matchobj.lastindex - 1]
+
+    def sub(self, text):
+        return self.pattern.sub(self.__replace, text)
+
+
+_smiley_index = None
+
+
+def get_smiley_index():
+    "Return the process-wide smiley index, building it on first use"
+    global _smiley_index
+    if _smiley_index is None:
+        count('naxos_smiley_compiles_total')
+        _smiley_index = SmileyIndex(
+            get_smileys(settings.STATICFILES_DIRS[0]))
+    return _smiley_index
+
+
+def reload_smileys():
+    "Drop the smiley index, to be called when the smiley set has changed"
+    global _smiley_index
+    _smiley_index = None
+
+
+@receiver(setting_changed)
+def reload_smileys_on_setting_changed(setting, **kwargs):
+    if setting in ("STATIC_URL", "STATICFILES_DIRS"):
+        reload_smileys()
 
 
 def _smiley_replacer(text):
-    for smiley, name in compile_smileys():
-        tag = "<img class=\"smiley\" src=\"{:s}img/smileys/{:s}.gif\">"\
-                    .format(settings.STATIC_URL, quote(name))
-        text = smiley.sub(tag, text)
-    return text
+    return get_smiley_index().sub(text)
 
 
 def smilify(html):
@@ -164,32 +212,49 @@ class UserReferences:
 
     def __init__(self, text):
         self.text = text
+        self._users = None
+
+    @property
+    def names(self):
+        "Referenced names, in order of first appearance"
+        return list(dict.fromkeys(
+            m.group(2) for m in re.finditer(self.matching_pattern, self.text)))
+
+    @property
+    def users(self):
+        "Referenced users, resolved with a single query on first access"
+        if self._users is None:
+            names = self.names
+            self._users = list(
+                ForumUser.objects.filter(username__in=names)) if names else []
+        return self._users
 
     def __render_tag(self, matchobj):
-        user = ForumUser.objects.filter(username=matchobj.group(2)).first()
-        if user or matchobj.group(2) == "all":
+        if matchobj.group(2) in self.__usernames or \
+           matchobj.group(2) == "all":
             return matchobj.group(1) + "[user]@" + matchobj.group(2) + "[/user]"
         else:
             return matchobj.group(1) + "@" + matchobj.group(2)
 
-    def render(self):
-        return re.sub(self.matching_pattern, self.__render_tag, self.text)
+    def render(self, text=None):
+        """
+        Tag references to existing users. Another text referencing the same
+        names, such as the scanned text once preprocessed, may be given.
+        """
+        self.__usernames = {user.username for user in self.users}
+        return re.sub(self.matching_pattern, self.__render_tag,
+                      self.text if text is None else text)
+
+    @property
+    def mentions_all(self):
+        return bool(re.search(self.match_all, self.text))
 
     def get_users(self):
-        if re.search(self.match_all, self.text):
+        if self.mentions_all:
             for user in ForumUser.objects.all():
                 yield user
             return
-        processed_names = []
-        match_iter = re.finditer(self.matching_pattern, self.text)
-        for matchobj in match_iter:
-            name = matchobj.group(2)
-            if name in processed_names:
-                continue
-            processed_names.append(name)
-            user = ForumUser.objects.filter(username=matchobj.group(2)).first()
-            if user:
-                yield user
+        yield from self.users
 
     def __remove_tag(self, matchobj):
         return matchobj.group(1) + matchobj.group(2)
@@ -199,6 +264,10 @@ class UserReferences:
 
 
 # Rendering
+# Bump whenever a change in this module alters the rendered html: stored html
+# stamped with an older version is then re-rendered (see RenderedModel)
+RENDERER_VERSION = 1
+
 render_bbcode = create(use_pygments=False, annotate_links=False, exclude=["img"])
 render_bbcode.add_tag(CustomImgTag, 'img')
 render_bbcode.add_tag(SpoilerTag, 'spoiler')
@@ -206,10 +275,12 @@ render_bbcode.add_tag(SimpleTag, 'user', "u class='user-tag'")
 render_bbcode.add_tag(VideoTag, 'video')
 
 
-def render(text, markup='bbcode'):
+def render(text, markup='bbcode', references=None):
     if markup == 'bbcode':
         text = rm_legacy_tags(text)  # TODO: make db migration instead
-        text = UserReferences(text).render()
+        if references is None:
+            references = UserReferences(text)
+        text = references.render(text)
         return smilify(render_bbcode(text, cosmetic_replace=False))
     elif markup == 'markdown':
         return markdown.markdown(text, safe_mode='escape')
@@ -0,0 +1,75 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+
+from forum.models import Post
+from forum.testcases import ForumTestCase
+from .management.commands import rerender
+from .renderer import RENDERER_VERSION
+
+
+class RenderedModelTest(ForumTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.posts = [Post.objects.create(
+            thread=cls.thread, author=cls.user,
+            content_plain='[b]Post {}[/b]'.format(i)) for i in range(3)]
+
+    def outdate(self):
+        """Stamp the posts with an older renderer version."""
+        Post.objects.update(content_html='', renderer_version=0)
+
+    def test_render_on_save(self):
+        post = Post.objects.get(pk=self.posts[0].pk)
+        self.assertEqual(post.renderer_version, RENDERER_VERSION)
+        self.assertIn('<strong>Post 0</strong>', post.content_html)
+        post.content_plain = '[i]Edited[/i]'
+        post.save()
+        self.assertIn('<em>Edited</em>',
+                      Post.objects.get(pk=post.pk).content_html)
+
+    def test_stale_html(self):
+        self.outdate()
+        post = Post.objects.get(pk=self.posts[0].pk)
+        self.assertIn('<strong>Post 0</strong>', post.html)
+        post = Post.objects.get(pk=post.pk)
+        self.assertEqual(post.renderer_version, RENDERER_VERSION)
+        self.assertIn('<strong>Post 0</strong>', post.content_html)
+
+    def test_rerender(self):
+        self.outdate()
+        call_command('rerender', model=['post'], processes=0, batch_size=2,
+                     stdout=StringIO())
+        for post in Post.objects.all():
+            self.assertEqual(post.renderer_version, RENDERER_VERSION)
+            self.assertIn('<strong>Post', post.content_html)
+
+    def test_rerender_keeps_edits(self):
+        self.outdate()
+        edited = Post.objects.get(pk=self.posts[1].pk)
+        render_row = rerender.render_row
+
+        def edit_then_render(row):
+            if row[0] == edited.pk:  # Saved while its batch renders
+                edited.content_plain = 'Edited'
+                edited.save()
+            return render_row(row)
+        with mock.patch.object(rerender, 'render_row', edit_then_render):
+            call_command('rerender', model=['post'], processes=0,
+                         stdout=StringIO())
+        post = Post.objects.get(pk=edited.pk)
+        self.assertEqual(post.content_plain, 'Edited')
+        self.assertNotIn('Post 1', post.content_html)
+        self.assertIn('<strong>Post 2</strong>',
+                      Post.objects.get(pk=self.posts[2].pk).content_html)
+
+    def test_templates_read_content_html(self):
+        Post.objects.filter(pk=self.posts[0].pk).update(
+            content_html='<p>Stored html</p>')
+        self.client.force_login(self.user)
+        response = self.client.get('/forum/test/test/')
+        self.assertContains(response, '<p>Stored html</p>')
+        self.assertNotContains(response, '<strong>Post 0</strong>')
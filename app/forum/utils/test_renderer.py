@@ -0,0 +1,47 @@
+from django.test import SimpleTestCase, TestCase
+
+from user.models import ForumUser
+from .renderer import UserReferences, get_smiley_index, render, smilify
+
+
+class SmileyTest(SimpleTestCase):
+
+    def test_smilify(self):
+        html = smilify("Salut :salut: :) ;-) :-/")
+        self.assertEqual(html.count('class="smiley"'), 4)
+        self.assertIn('img/smileys/salut.gif', html)
+        self.assertIn('img/smileys/special-smile.gif', html)
+        self.assertIn('img/smileys/special-wink.gif', html)
+        self.assertIn('img/smileys/bof.gif', html)
+
+    def test_links_are_left_alone(self):
+        html = '<a href="http://example.com">http://example.com :D</a>'
+        self.assertEqual(smilify(html), html)
+
+    def test_replacements_are_not_rescanned(self):
+        html = get_smiley_index().sub(":-/ :o")
+        self.assertEqual(html.count('class="smiley"'), 2)
+        self.assertNotIn(":-/", html)
+
+
+class UserReferencesTest(TestCase):
+
+    def setUp(self):
+        for username in ('jacob', 'paul', 'marc'):
+            ForumUser.objects.create_user(username=username,
+                                          email=username + '@test.com')
+
+    def test_single_query(self):
+        text = "@jacob @paul\n@marc @nobody [b]x[/b]@jacob"
+        references = UserReferences(text)
+        with self.assertNumQueries(1):
+            html = render(text, references=references)
+            users = list(references.get_users())
+        self.assertEqual(html.count("user-tag"), 4)
+        self.assertIn("@nobody", html)
+        self.assertEqual(sorted(u.username for u in users),
+                         ['jacob', 'marc', 'paul'])
+
+    def test_no_reference(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(list(UserReferences("no one").get_users()), [])